@@ -1,24 +1,49 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from playwright.async_api import async_playwright
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
 from playwright_stealth import stealth_async
-from bs4 import BeautifulSoup, NavigableString, Tag
+from concurrent.futures import ProcessPoolExecutor
 import asyncio
+import multiprocessing
 import json
 import os
 import re
 from urllib.parse import urljoin, urlparse
 import datetime
+import time
 import traceback 
-
-app = Flask(__name__)
-CORS(app)
+from browser_pool import get_browser_pool, PoolBusyError
+from readiness import WaitRecorder, wait_until_ready, table_signature, wait_stats_snapshot
+from snapshot_cache import snapshot_cache
+from scheduler import RatesScheduler, RatesStore, parse_poll_interval, SCHEDULER_ENABLED
+from html_engine import parse_rates_from_html, parse_rates_incremental, parse_channel_snapshot
+from resource_profile import ResourceStats, apply_resource_profile
+from debug_writer import DebugSnapshotWriter
+from change_tracker import change_tracker
+from batch_jobs import BatchRenderManager, BATCH_MAX_ITEMS
+from metrics import StageTimer, detect_blocked_page, is_blocked_title, count_scrape, count_blocked_page, count_interaction_failure, count_render_request, metrics_exposition
+from xhr_capture import XhrCapture, XhrRecipeStore, XhrReplayError, replay_recipe, close_http_client, XHR_CAPTURE_DEFAULT, XHR_RECIPE_DIR
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
 
 CONFIG_DIR = "configs"
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
 DEBUG_HTML_SAVE_DIR = "debug_channel_html_snapshots"
-os.makedirs(DEBUG_HTML_SAVE_DIR, exist_ok=True)
+
+ISBANK_CHANNEL_SELECT_SELECTOR = 'select#fxRateType'
+ISBANK_VIEW_BUTTON_SELECTOR = 'div.dK_button1[onclick*="CallHandler()"]'
+ISBANK_TABLE_SELECTOR = "div.dk_MC table"
+TAB_SELECTORS_STR = 'ul.nav-tabs li a[data-toggle="pill"], [role="tablist"] [role="tab"], a.nav-link[data-bs-toggle="tab"], button.nav-link[data-bs-toggle="tab"]' # افزودن سلکتورهای بیشتر برای تب‌های Bootstrap 5
+
+TAB_PANE_ID_JS = "el => el.getAttribute('href') || el.getAttribute('data-bs-target') || el.getAttribute('aria-controls') || el.getAttribute('data-target')"
+
+PARSE_PROCESS_WORKERS = int(os.environ.get("SCRAPER_PARSE_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PARALLEL_CHANNELS_DEFAULT = os.environ.get("SCRAPER_PARALLEL_CHANNELS", "0") == "1"
+PARALLEL_CHANNEL_PAGES = int(os.environ.get("SCRAPER_PARALLEL_CHANNEL_PAGES", "4"))
+INCREMENTAL_PARSE_ENABLED = os.environ.get("SCRAPER_INCREMENTAL_PARSE", "1") == "1"
+CHANGE_STREAM_KEEPALIVE_S = 15
 
 
 def get_safe_filename(text_input):
@@ -33,280 +58,362 @@ def get_safe_filename(text_input):
     return safe_name[:100] 
 
 
-async def save_debug_html(url, channel_name, html_content, page_title, stage_description=""):
-    if not html_content: return
-    base_file_name = get_safe_filename(url)
-    safe_channel_name = get_safe_filename(channel_name)
-    safe_stage_desc = get_safe_filename(stage_description) if stage_description else "content"
-    timestamp_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-    filename = f"{base_file_name}_ch_{safe_channel_name}_stg_{safe_stage_desc}_{timestamp_str}.html"
-    filepath = os.path.join(DEBUG_HTML_SAVE_DIR, filename)
-    header_comment = (f"<!-- DEBUG: URL:{url} CH:{channel_name} PGTITLE:{page_title} STG:{stage_description} TS:{datetime.datetime.now().isoformat()} FILE:{filename} -->\n\n")
-    try:
-        with open(filepath, "w", encoding="utf-8") as f: f.write(header_comment + html_content)
-       
-    except Exception as e: print(f"[DEBUG_SAVE_ERR] {filepath}: {e}")
+debug_writer = DebugSnapshotWriter(DEBUG_HTML_SAVE_DIR, get_safe_filename)
+xhr_recipes = XhrRecipeStore(XHR_RECIPE_DIR, get_safe_filename)
 
 
-async def get_page_content_for_all_channels(url):
-    all_channel_data = []
-    async with async_playwright() as p:
-        user_agent_string = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
-        browser = await p.chromium.launch(headless=True) 
-        context = await browser.new_context(user_agent=user_agent_string, viewport={'width': 1920, 'height': 1080}, java_script_enabled=True, ignore_https_errors=True)
-        page = await context.new_page()
-        await stealth_async(page)
-        processed_channel_identifiers_in_playwright = set()
+async def new_scrape_page(context, url, resource_stats, xhr_capture=None):
+    page = await context.new_page()
+    await stealth_async(page)
+    await apply_resource_profile(page, url, resource_stats)
+    if xhr_capture: xhr_capture.attach(page)
+    return page
 
-        try:
-            await page.goto(url, timeout=90000, wait_until='domcontentloaded') 
-            await page.wait_for_timeout(8000) 
-            initial_html_content = await page.content()
-            initial_page_title = await page.title()
-            await save_debug_html(url, "InitialPageLoad", initial_html_content, initial_page_title, "initial_load_before_interaction")
-            for _ in range(2): 
-                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)"); await page.wait_for_timeout(2500)
-            await page.evaluate("window.scrollTo(0, 0)"); await page.wait_for_timeout(1500)
-
-            found_channels_list = []
-            isbank_channel_select = await page.query_selector('select#fxRateType')
-            
-            if isbank_channel_select:
-                options_elements = await isbank_channel_select.query_selector_all('option')
-                view_button_isbank_selector = 'div.dK_button1[onclick*="CallHandler()"]'
-                for option_el in options_elements:
-                    opt_value = await option_el.get_attribute("value")
-                    opt_text_content = (await option_el.text_content() or "").strip()
-                    if not opt_value or not opt_text_content: continue
-                    channel_name_isbank = opt_text_content
-                    isbank_parsing_context_id = f"isbank_content_for_{opt_value}"
-                    unique_id_for_processing = f"isbank_select_{opt_value}"
-                    if unique_id_for_processing not in processed_channel_identifiers_in_playwright:
+
+async def load_page_for_scrape(page, url, wait_recorder, stage_timer):
+    with stage_timer.stage("goto"): response = await page.goto(url, timeout=90000, wait_until='domcontentloaded') 
+    await wait_until_ready(page, wait_recorder, "initial_load", table_selector="table", network_idle=True)
+    return response
+
+
+async def scroll_page_for_lazy_content(page, wait_recorder):
+    for _ in range(2): 
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)"); await wait_until_ready(page, wait_recorder, "scroll")
+    await page.evaluate("window.scrollTo(0, 0)"); await wait_until_ready(page, wait_recorder, "scroll_top")
+
+
+async def discover_channels(page):
+    found_channels_list = []
+    processed_channel_identifiers_in_playwright = set()
+    isbank_channel_select = await page.query_selector(ISBANK_CHANNEL_SELECT_SELECTOR)
+    
+    if isbank_channel_select:
+        options_elements = await isbank_channel_select.query_selector_all('option')
+        for option_el in options_elements:
+            opt_value = await option_el.get_attribute("value")
+            opt_text_content = (await option_el.text_content() or "").strip()
+            if not opt_value or not opt_text_content: continue
+            channel_name_isbank = opt_text_content
+            isbank_parsing_context_id = f"isbank_content_for_{opt_value}"
+            unique_id_for_processing = f"isbank_select_{opt_value}"
+            if unique_id_for_processing not in processed_channel_identifiers_in_playwright:
+                found_channels_list.append({
+                    "name": channel_name_isbank, "value_for_interaction": opt_value,
+                    "active_tab_id_in_html": isbank_parsing_context_id, "is_select_option": True, 
+                    "element_handle_for_interaction": isbank_channel_select,
+                    "view_button_selector": ISBANK_VIEW_BUTTON_SELECTOR,
+                    "ready_table_selector": ISBANK_TABLE_SELECTOR,
+                    "identifier": unique_id_for_processing, "is_tab": False 
+                })
+                processed_channel_identifiers_in_playwright.add(unique_id_for_processing)
+    else:
+        tab_elements = await page.query_selector_all(TAB_SELECTORS_STR)
+        for tab_el in tab_elements:
+            try:
+                tab_text = (await tab_el.text_content() or "").strip()
+                if not tab_text or not await tab_el.is_visible(): continue # اگر متنی ندارد یا قابل مشاهده نیست، رد کن
+
+                tab_pane_id_attr = await tab_el.evaluate(TAB_PANE_ID_JS) # data-target برای آکوردئون‌های قدیمی‌تر
+
+                if tab_text and tab_pane_id_attr:
+                    actual_tab_pane_id = tab_pane_id_attr.lstrip('#')
+                    unique_id = f"tab_{get_safe_filename(tab_text)}_{actual_tab_pane_id}"
+                    if unique_id not in processed_channel_identifiers_in_playwright:
                         found_channels_list.append({
-                            "name": channel_name_isbank, "value_for_interaction": opt_value,
-                            "active_tab_id_in_html": isbank_parsing_context_id, "is_select_option": True, 
-                            "element_handle_for_interaction": isbank_channel_select,
-                            "view_button_selector": view_button_isbank_selector,
-                            "identifier": unique_id_for_processing, "is_tab": False 
+                            "name": tab_text, "value_for_interaction": actual_tab_pane_id,
+                            "active_tab_id_in_html": actual_tab_pane_id, 
+                            "is_select_option": False, "element_handle_for_interaction": tab_el,
+                            "view_button_selector": None, "ready_table_selector": f"[id='{actual_tab_pane_id}'] table",
+                            "identifier": unique_id, "is_tab": True
                         })
-                        processed_channel_identifiers_in_playwright.add(unique_id_for_processing)
-            else:
-                tab_selectors_str = 'ul.nav-tabs li a[data-toggle="pill"], [role="tablist"] [role="tab"], a.nav-link[data-bs-toggle="tab"], button.nav-link[data-bs-toggle="tab"]' # افزودن سلکتورهای بیشتر برای تب‌های Bootstrap 5
-                tab_elements = await page.query_selector_all(tab_selectors_str)
-                for tab_el in tab_elements:
-                    try:
-                        tab_text = (await tab_el.text_content() or "").strip()
-                        if not tab_text or not await tab_el.is_visible(): continue # اگر متنی ندارد یا قابل مشاهده نیست، رد کن
-
-                        tab_pane_id_attr = await tab_el.get_attribute("href") or await tab_el.get_attribute("data-bs-target") or await tab_el.get_attribute("aria-controls") or await tab_el.get_attribute("data-target") # برای آکوردئون‌های قدیمی‌تر
-
-                        if tab_text and tab_pane_id_attr:
-                            actual_tab_pane_id = tab_pane_id_attr.lstrip('#')
-                            unique_id = f"tab_{get_safe_filename(tab_text)}_{actual_tab_pane_id}"
-                            if unique_id not in processed_channel_identifiers_in_playwright:
-                                found_channels_list.append({
-                                    "name": tab_text, "value_for_interaction": actual_tab_pane_id,
-                                    "active_tab_id_in_html": actual_tab_pane_id, 
-                                    "is_select_option": False, "element_handle_for_interaction": tab_el,
-                                    "view_button_selector": None, "identifier": unique_id, "is_tab": True
-                                })
-                                processed_channel_identifiers_in_playwright.add(unique_id)
-                    except Exception as e_tab_proc: print(f"Error processing tab element: {e_tab_proc}")
-
-            if not found_channels_list:
-                found_channels_list = [{"name": "Default Channel", "value_for_interaction": "default",
-                                     "active_tab_id_in_html": None, "is_select_option": False, 
-                                     "element_handle_for_interaction": None, "view_button_selector": None,
-                                     "identifier": "default_single_channel", "is_tab": False}]
-            
-            print(f"Found {len(found_channels_list)} channels to process for {url}")
-
-            for channel_info_item in found_channels_list:
-                ch_name = channel_info_item["name"]
-                interaction_val = channel_info_item["value_for_interaction"]
-                el_handle = channel_info_item["element_handle_for_interaction"]
-                active_tab_id_for_parser = channel_info_item["active_tab_id_in_html"]
-                
-                if channel_info_item["identifier"] != "default_single_channel":
-                    try:
-                        if channel_info_item["is_select_option"] and el_handle:
-                            await el_handle.select_option(value=interaction_val)
-                            await page.wait_for_timeout(2000) 
-                            if channel_info_item.get("view_button_selector"):
-                                view_btn = await page.query_selector(channel_info_item["view_button_selector"])
-                                if view_btn and await view_btn.is_enabled():
-                                    await view_btn.click(timeout=7000); await page.wait_for_timeout(6000) 
-                        elif el_handle: 
-                            await el_handle.click(timeout=7000); await page.wait_for_timeout(5000)
-                    except Exception as e_int: print(f"Interaction error ch:'{ch_name}': {e_int}"); continue
+                        processed_channel_identifiers_in_playwright.add(unique_id)
+            except Exception as e_tab_proc: print(f"Error processing tab element: {e_tab_proc}")
+
+    if not found_channels_list:
+        found_channels_list = [{"name": "Default Channel", "value_for_interaction": "default",
+                             "active_tab_id_in_html": None, "is_select_option": False, 
+                             "element_handle_for_interaction": None, "view_button_selector": None,
+                             "ready_table_selector": None, "identifier": "default_single_channel", "is_tab": False}]
+    return found_channels_list
+
+
+async def resolve_channel_handle(page, channel_info_item):
+    # Element handles belong to the discovery page; a replaying page looks its own up again.
+    if channel_info_item["is_select_option"]: return await page.query_selector(ISBANK_CHANNEL_SELECT_SELECTOR)
+    if not channel_info_item["is_tab"]: return None
+    for tab_el in await page.query_selector_all(TAB_SELECTORS_STR):
+        pane_attr = await tab_el.evaluate(TAB_PANE_ID_JS)
+        if pane_attr and pane_attr.lstrip('#') == channel_info_item["value_for_interaction"] and await tab_el.is_visible(): return tab_el
+    return None
+
+
+async def interact_with_channel(page, channel_info_item, el_handle, wait_recorder):
+    interaction_val = channel_info_item["value_for_interaction"]
+    ready_sel = channel_info_item.get("ready_table_selector")
+    if channel_info_item["is_select_option"] and el_handle:
+        # Re-selecting the current option won't redraw the table, so only wait for a change otherwise.
+        already_selected = await el_handle.evaluate("el => el.value") == interaction_val
+        prev_sig = None if already_selected else await table_signature(page, ready_sel)
+        await el_handle.select_option(value=interaction_val)
+        await wait_until_ready(page, wait_recorder, "select_option")
+        if channel_info_item.get("view_button_selector"):
+            view_btn = await page.query_selector(channel_info_item["view_button_selector"])
+            if view_btn and await view_btn.is_enabled():
+                await view_btn.click(timeout=7000)
+                await wait_until_ready(page, wait_recorder, "view_button", table_selector=ready_sel, previous_signature=prev_sig)
+    elif el_handle: 
+        await el_handle.click(timeout=7000)
+        await wait_until_ready(page, wait_recorder, "tab_click", table_selector=ready_sel)
+    else: raise RuntimeError(f"No element to interact with for '{channel_info_item['identifier']}'")
+
+
+async def scrape_channel_batch(page, url, indexed_channels, wait_recorder, debug_capture, stage_timer, replay=False, xhr_capture=None):
+    batch_results = []
+    for ch_index, channel_info_item in indexed_channels:
+        ch_name = channel_info_item["name"]
+        interaction_val = channel_info_item["value_for_interaction"]
+        wait_mark = wait_recorder.mark()
+        xhr_mark = xhr_capture.begin_channel(page) if xhr_capture else None
+        
+        if channel_info_item["identifier"] != "default_single_channel":
+            try:
+                with stage_timer.stage("interaction", ch_name):
+                    el_handle = await resolve_channel_handle(page, channel_info_item) if replay else channel_info_item["element_handle_for_interaction"]
+                    await interact_with_channel(page, channel_info_item, el_handle, wait_recorder)
+            except Exception as e_int:
+                print(f"Interaction error ch:'{ch_name}': {e_int}"); debug_capture.mark_failure(); count_interaction_failure(url)
+                try: debug_capture.add(ch_name, await page.content(), await page.title(), f"interaction_error_with_{get_safe_filename(interaction_val) or 'default'}")
+                except Exception: pass
+                continue
 
+        try:
+            with stage_timer.stage("page_content", ch_name):
                 current_content_html = await page.content()
                 current_pg_title = await page.title()
-                await save_debug_html(url, ch_name, current_content_html, current_pg_title, f"content_after_interaction_with_{get_safe_filename(interaction_val) or 'default'}")
-                all_channel_data.append({
-                    "channel_name": ch_name, "html_content": current_content_html,
-                    "page_title": current_pg_title, "timestamp": datetime.datetime.now().isoformat(),
-                    "active_tab_id_in_html": active_tab_id_for_parser 
-                })
-        except Exception as e_glob: print(f"Global Playwright error: {e_glob}"); traceback.print_exc()
+        except Exception as e_cap:
+            # e.g. the page is still navigating; keep the channels already captured and try the next one.
+            print(f"Capture error ch:'{ch_name}': {e_cap}"); debug_capture.mark_failure()
+            continue
+        debug_capture.add(ch_name, current_content_html, current_pg_title, f"content_after_interaction_with_{get_safe_filename(interaction_val) or 'default'}", channel_info_item["active_tab_id_in_html"])
+        if is_blocked_title(current_pg_title): print(f"[BLOCKED] {url}: channel '{ch_name}' shows a blocked page (Title: {current_pg_title})"); count_blocked_page(url, "blocked_title"); debug_capture.mark_failure()
+        if xhr_capture: await xhr_capture.end_channel(page, ch_name, xhr_mark)
+        batch_results.append((ch_index, {
+            "channel_name": ch_name, "html_content": current_content_html,
+            "page_title": current_pg_title, "timestamp": datetime.datetime.now().isoformat(),
+            "active_tab_id_in_html": channel_info_item["active_tab_id_in_html"],
+            "wait_timings": wait_recorder.since(wait_mark)
+        }))
+    return batch_results
+
+
+async def scrape_channel_batch_on_new_page(context, url, indexed_channels, wait_recorder, resource_stats, debug_capture, stage_timer, xhr_capture=None):
+    with stage_timer.stage("new_page"): page = await new_scrape_page(context, url, resource_stats, xhr_capture)
+    try:
+        await load_page_for_scrape(page, url, wait_recorder, stage_timer)
+        await scroll_page_for_lazy_content(page, wait_recorder)
+        return await scrape_channel_batch(page, url, indexed_channels, wait_recorder, debug_capture, stage_timer, replay=True, xhr_capture=xhr_capture)
+    finally:
+        try: await page.close()
+        except Exception: pass
+
+
+async def get_page_content_for_all_channels(url, parallel_channels=None, capture_xhr=False, stage_timer=None):
+    if parallel_channels is None: parallel_channels = PARALLEL_CHANNELS_DEFAULT
+    if stage_timer is None: stage_timer = StageTimer(url)
+    indexed_results = []
+    resource_stats = ResourceStats()
+    debug_capture = debug_writer.begin_scrape(url)
+    xhr_capture = XhrCapture(url) if capture_xhr else None
+    scrape_started = time.perf_counter()
+    async with get_browser_pool().lease() as slot:
+        # Queueing for a free slot and preparing it (browser launch, context creation) are timed apart.
+        stage_timer.observe("pool_wait", slot.wait_s)
+        stage_timer.observe("lease", time.perf_counter() - scrape_started - slot.wait_s)
+        with stage_timer.stage("new_page"): page = await new_scrape_page(slot.context, url, resource_stats, xhr_capture)
+        wait_recorders = [WaitRecorder(url)]
+
+        try:
+            response = await load_page_for_scrape(page, url, wait_recorders[0], stage_timer)
+            with stage_timer.stage("page_content"):
+                initial_html_content = await page.content()
+                initial_page_title = await page.title()
+            debug_capture.add("InitialPageLoad", initial_html_content, initial_page_title, "initial_load_before_interaction")
+            blocked_reason = detect_blocked_page(response.status if response else None, initial_html_content)
+            if blocked_reason: print(f"[BLOCKED] {url}: looks like a bot wall ({blocked_reason})"); count_blocked_page(url, blocked_reason); debug_capture.mark_failure()
+            await scroll_page_for_lazy_content(page, wait_recorders[0])
+
+            with stage_timer.stage("discover_channels"): found_channels_list = await discover_channels(page)
+            indexed_channels = list(enumerate(found_channels_list))
+            page_count = min(PARALLEL_CHANNEL_PAGES, len(indexed_channels)) if parallel_channels else 1
+            print(f"Found {len(found_channels_list)} channels to process for {url} ({page_count} page(s))")
+
+            if page_count <= 1:
+                indexed_results = await scrape_channel_batch(page, url, indexed_channels, wait_recorders[0], debug_capture, stage_timer, xhr_capture=xhr_capture)
+            else:
+                # Batch 0 stays on the already-loaded discovery page; the rest replay their channels on fresh pages.
+                batches = [indexed_channels[i::page_count] for i in range(page_count)]
+                wait_recorders += [WaitRecorder(url) for _ in batches[1:]]
+                batch_outcomes = await asyncio.gather(
+                    scrape_channel_batch(page, url, batches[0], wait_recorders[0], debug_capture, stage_timer, xhr_capture=xhr_capture),
+                    *(scrape_channel_batch_on_new_page(slot.context, url, batch, rec, resource_stats, debug_capture, stage_timer, xhr_capture) for batch, rec in zip(batches[1:], wait_recorders[1:])),
+                    return_exceptions=True)
+                for batch, outcome in zip(batches, batch_outcomes):
+                    if isinstance(outcome, Exception): print(f"Channel batch error ({[ch['name'] for _, ch in batch]}): {outcome}"); debug_capture.mark_failure(); continue
+                    indexed_results.extend(outcome)
+        except Exception as e_glob: print(f"Global Playwright error: {e_glob}"); traceback.print_exc(); slot.mark_broken(); debug_capture.mark_failure()
         finally:
-            if 'context' in locals() and context: await context.close()
-            if 'browser' in locals() and browser: await browser.close()
-        return all_channel_data
-
-def parse_selectable_tags(html_content, channel_name, active_tab_id_in_html=None, current_url=None): 
-    if not html_content: return {}, []
-    soup = BeautifulSoup(html_content, 'html.parser')
-    selectable_tags_list = []
-    processed_selectors_in_this_channel = set()
-    search_context = soup
-    
-    is_isbank = current_url and "isbank.com.tr" in urlparse(current_url).netloc
-    is_borsaistanbul = current_url and "borsaistanbul.com" in urlparse(current_url).netloc
-    is_kuveytturk = current_url and "kuveytturk.com.tr" in urlparse(current_url).netloc
-
-    if active_tab_id_in_html and not active_tab_id_in_html.startswith("isbank_content_for_"):
-        tab_pane_container = soup.find('div', id=active_tab_id_in_html, class_=lambda x: x and 'tab-pane' in x.split())
-        if tab_pane_container: search_context = tab_pane_container
-        else: active_fallback = soup.find('div', class_='tab-pane active show'); search_context = active_fallback if active_fallback else soup
-    elif is_isbank:
-        isbank_table_container = soup.find('div', class_='dk_MC')
-        if isbank_table_container: search_context = isbank_table_container
-    elif is_kuveytturk and active_tab_id_in_html: # Kuveytturk'te tab ID'si var ama محتوا در همانجا لود نمی‌شود
-         tab_pane_container_kt = soup.find('div', id=active_tab_id_in_html, class_=re.compile(r'tab-pane'))
-         if tab_pane_container_kt: search_context = tab_pane_container_kt
-         else: print(f"[PST_WARN:{channel_name}] KuveytTurk tab pane #{active_tab_id_in_html} not found, using full soup.")
-
-    potential_tables = search_context.find_all('table', recursive=True)
-    tables_to_add_final = []
-    for table_tag in potential_tables:
-        rows_in_table = table_tag.find_all('tr', recursive=False)
-        if not rows_in_table and table_tag.find('tbody'): rows_in_table = table_tag.find('tbody').find_all('tr', recursive=False)
-        if not rows_in_table or len(rows_in_table) < 1 : continue 
-        
-        first_valid_row = next((r for r in rows_in_table if r.find(['th', 'td'])), None)
-        if not first_valid_row: continue
-        cols_count = len(first_valid_row.find_all(['td', 'th'], recursive=False))
-        if cols_count < 1 : continue
-
-        relevant_table = False
-        if is_isbank: relevant_table = 'dk_MT' in (table_tag.get('class', []))
-        elif is_borsaistanbul: relevant_table = table_tag.get('id') and 'indexpage-' in table_tag.get('id')
-        elif is_kuveytturk: 
-            relevant_table = 'table-portal' in table_tag.get('class', []) and table_tag.find_parent(class_='table-responsive')
-        else: relevant_table = not table_tag.find_parent(class_=lambda x: x and 'datetimepicker' in x.split())
-        if not relevant_table: continue
-        tables_to_add_final.append(table_tag)
-
-    for table_tag in tables_to_add_final:
-        tag_id = table_tag.get('id'); classes = table_tag.get('class', [])
-        rows = table_tag.find_all('tr'); row_count = len(rows)
-        first_row = next((r for r in rows if r.find(['th', 'td'])), None)
-        cols_count = len(first_row.find_all(['td', 'th'], recursive=False)) if first_row else 0
-
-        base_sel = f"table#{tag_id}" if tag_id and not tag_id.isnumeric() else \
-                   (f"table.{'.'.join(sorted(list(set(c for c in classes if c and c not in ['table', 'table-condensed', 'table-responsive']))[:2]))}" if \
-                    [c for c in classes if c and c not in ['table', 'table-condensed', 'table-responsive']] else "table")
-        
-        final_sel = base_sel
-        if active_tab_id_in_html and not active_tab_id_in_html.startswith(("isbank_content_for_", "generated_id_")) and not is_isbank:
-            final_sel = f"#{active_tab_id_in_html} {base_sel}"
-        elif base_sel == "table": # عمومی‌ترین حالت، سعی در دقیق‌تر کردن
-            parent_id_el = table_tag.find_parent(id=re.compile(r'^[a-zA-Z][\w-]*$')) # ID معتبر
-            if parent_id_el: final_sel = f"#{parent_id_el.get('id')} table"
-        
-        text_prev = table_tag.get_text(separator=' ', strip=True)[:50].replace('\n',' ') + "..."
-        disp_name = f"T(Sel:{final_sel[:20]}..,R:{row_count}C:{cols_count})P:{text_prev[:15]}"
-        unique_key_ch = (final_sel, row_count, cols_count, text_prev[:15])
-        if unique_key_ch in processed_selectors_in_this_channel: continue
-        processed_selectors_in_this_channel.add(unique_key_ch)
-        selectable_tags_list.append({
-            "display_name_from_parser": disp_name, "selector": final_sel, "id_attr": tag_id, 
-            "class_attr": classes, "text_preview": text_prev, "row_count": row_count, "col_count": cols_count
-        })
-    return {"channel_name": channel_name}, selectable_tags_list
-
-def parse_rates_from_html(html_content, base_url, page_title_from_playwright, channel_name, selected_selectors):
-    market_data_by_selector = {}; parsing_error_messages = []
-    if not html_content: return {}, "HTML content None."
-    soup = BeautifulSoup(html_content, 'html.parser')
-    if "Engellendi" in page_title_from_playwright or "Blocked" in page_title_from_playwright:
-        return {}, f"Page blocked (Title: {page_title_from_playwright})."
-    if not selected_selectors: return {}, "No selectors."
-
-    for selector_str in selected_selectors:
-        elements_found = []; 
-        try: elements_found = soup.select(selector_str)
-        except Exception as e: msg = f"BS4 sel err '{selector_str}': {e}"; parsing_error_messages.append(msg); market_data_by_selector[selector_str] = []; continue
-        if not elements_found: market_data_by_selector[selector_str] = []; continue
-            
-        data_for_this_selector = []
-        for elem_idx, table_el in enumerate(elements_found): 
-            if not isinstance(table_el, Tag) or table_el.name != 'table': continue
-            
-            hdrs = []; hr_el = None; thead = table_el.find('thead'); 
-            if thead: hr_el = thead.find('tr')
-            if not hr_el:
-                cand_trs = table_el.find_all('tr', recursive=False)
-                if not cand_trs and table_el.find('tbody'): cand_trs = table_el.find('tbody').find_all('tr', recursive=False)
-                for tr in cand_trs: 
-                    if tr.find_all('th', recursive=False): hr_el = tr; break
-                if not hr_el and cand_trs and cand_trs[0].find_all(['th','td'], recursive=False): hr_el = cand_trs[0]
-
-            if not hr_el: msg = f"No header for '{selector_str}'"; parsing_error_messages.append(msg); continue
-            
-            h_cells = hr_el.find_all(['th', 'td'], recursive=False)
-            for i, cell_h in enumerate(h_cells):
-                ht = cell_h.get_text(strip=True)
-                hdrs.append(ht if ht else ("item_name" if i == 0 and len(h_cells) > 1 else f"column_{i+1}"))
-            
-            if not hdrs: msg = f"Empty headers for '{selector_str}'"; parsing_error_messages.append(msg); continue
-
-            data_rows_cont = table_el.find('tbody') or table_el
-            for data_row in data_rows_cont.find_all('tr', recursive=False):
-                if data_row == hr_el or not data_row.find_all(['td', 'th'], recursive=False): continue
-                cells = data_row.find_all(['td', 'th'], recursive=False)
-                if len(cells) < 1 : continue
-                entry = {}
-                for i_c, h_txt in enumerate(hdrs): 
-                    val = "N/A"
-                    if i_c < len(cells):
-                        raw = cells[i_c].get_text(strip=True); val = raw.replace(',', '.')
-                        val = re.sub(r'\s+(?:TL|USD|EUR|₺|%)\s*$', '', val, flags=re.I).strip()
-                        if not val and raw: val = raw
-                    clean_h = re.sub(r'\s+', '_', h_txt.lower()); clean_h = re.sub(r'[^\w_.-]', '', clean_h).strip('_.- '); 
-                    entry[clean_h if clean_h else f"col_{i_c+1}"] = val
-                if entry: data_for_this_selector.append(entry)
-            market_data_by_selector[selector_str] = data_for_this_selector
-    return market_data_by_selector, ("; ".join(parsing_error_messages) if parsing_error_messages else None)
+            try: await page.close()
+            except Exception: slot.mark_broken()
+        print(f"[WAIT] {wait_recorders[0].domain}: waited {sum(r.total_ms() for r in wait_recorders)} ms over {sum(len(r.records) for r in wait_recorders)} wait steps")
+        resource_summary = resource_stats.as_dict()
+        print(f"[RES] {wait_recorders[0].domain}: blocked {resource_summary['requests_blocked']}/{resource_summary['requests_total']} requests, ~{resource_summary['estimated_bytes_saved'] // 1024} KB saved, {resource_summary['bytes_loaded'] // 1024} KB loaded")
+        channel_results = [ch_data for _, ch_data in sorted(indexed_results, key=lambda item: item[0])]
+        debug_capture.finish(success=bool(channel_results))
+        for ch_data in channel_results: ch_data["resource_stats"] = resource_summary
+    for rec in wait_recorders: stage_timer.observe_waits(rec)
+    stage_timer.observe("browser_scrape", time.perf_counter() - scrape_started)
+    count_scrape(url, "success" if channel_results else "failed")
+    if xhr_capture and channel_results: await record_xhr_recipe(xhr_capture, channel_results)
+    return channel_results
+
+async def record_xhr_recipe(xhr_capture, channel_results):
+    try: recipe = await xhr_capture.build_recipe(channel_results, run_parse_job)
+    except Exception as e: print(f"[XHR_WARN] Recipe build failed for {xhr_capture.url}: {e}"); return
+    if not recipe: print(f"[XHR] {xhr_capture.url}: no replayable XHR found for every channel, staying on the browser path"); return
+    await asyncio.to_thread(xhr_recipes.put, xhr_capture.url, recipe)
+    print(f"[XHR] {xhr_capture.url}: recorded direct-replay recipe for {len(recipe['channels'])} channel(s)")
+
+async def fetch_channel_snapshots(url, parallel_channels=None, capture_mode=None, stage_timer=None):
+    # capture_mode "xhr" replays recorded API calls without a browser; "browser" (or None with capture off) always renders.
+    if capture_mode is None: capture_mode = "xhr" if XHR_CAPTURE_DEFAULT else "browser"
+    if capture_mode != "xhr": return await get_page_content_for_all_channels(url, parallel_channels=parallel_channels, stage_timer=stage_timer)
+    if stage_timer is None: stage_timer = StageTimer(url)
+    recipe = await asyncio.to_thread(xhr_recipes.get, url)
+    if recipe:
+        try:
+            with stage_timer.stage("xhr_replay"): channel_html_data = await replay_recipe(recipe, run_parse_job)
+            count_scrape(url, "xhr_success"); return channel_html_data
+        except XhrReplayError as e:
+            print(f"[XHR] {url}: direct replay failed ({e}), falling back to the browser and re-recording")
+            count_scrape(url, "xhr_fallback"); await asyncio.to_thread(xhr_recipes.invalidate, url)
+    return await get_page_content_for_all_channels(url, parallel_channels=parallel_channels, capture_xhr=True, stage_timer=stage_timer)
+
+async def get_channel_snapshots(url, parallel_channels=None, use_cache=True, force_refresh=False, capture_mode=None, stage_timer=None):
+    if use_cache and not force_refresh:
+        cached_channels = snapshot_cache.get_channels(url)
+        if cached_channels is not None: return cached_channels, True
+    channel_html_data = await fetch_channel_snapshots(url, parallel_channels=parallel_channels, capture_mode=capture_mode, stage_timer=stage_timer)
+    if use_cache and channel_html_data: snapshot_cache.put_channels(url, channel_html_data)
+    return channel_html_data, False
+
+async def scrape_for_scheduler(url):
+    channel_html_data, _ = await get_channel_snapshots(url, force_refresh=True)
+    return channel_html_data
+
+# CPU-bound parsing runs in worker processes so one heavy page can't stall the shared event loop.
+# Spawned (not forked) workers: the server process holds a running loop and the Playwright driver.
+parse_executor = ProcessPoolExecutor(PARSE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")) if PARSE_PROCESS_WORKERS > 0 else None
+
+async def run_parse_job(parse_fn, *args):
+    if parse_executor is None: return parse_fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(parse_executor, parse_fn, *args)
+
+async def parse_rates_offloaded(*args):
+    return await run_parse_job(parse_rates_from_html, *args)
+
+async def parse_rates_tracked(html_content, url, page_title, channel_name, selectors, source, stage_timer=None):
+    # Only tables whose subtree hash moved since the last scrape are parsed; their row diffs go to the change stream.
+    t0 = time.perf_counter()
+    previous_hashes = change_tracker.previous_hashes(url, channel_name, selectors)
+    hashes, parsed_rates, p_err = await run_parse_job(parse_rates_incremental, html_content, url, page_title, channel_name, selectors, previous_hashes)
+    full_rates, deltas = change_tracker.apply(url, channel_name, hashes, parsed_rates)
+    if deltas: change_tracker.publish(url, channel_name, deltas, source)
+    if stage_timer: stage_timer.observe("parse_incremental", time.perf_counter() - t0, channel_name)
+    unchanged = [sel for sel in selectors if sel in full_rates and sel not in parsed_rates]
+    return full_rates, p_err, deltas, unchanged
+
+async def parse_rates_for_scheduler(html_content, url, page_title, channel_name, selectors):
+    if not INCREMENTAL_PARSE_ENABLED: return await parse_rates_offloaded(html_content, url, page_title, channel_name, selectors)
+    full_rates, p_err, _, _ = await parse_rates_tracked(html_content, url, page_title, channel_name, selectors, "scheduler")
+    return full_rates, p_err
+
+async def timed_parse_job(stage_timer, channel_name, parse_fn, *args):
+    # Wall time includes the hop to the worker process; the per-step times come back from the worker.
+    t0 = time.perf_counter()
+    result = await run_parse_job(parse_fn, *args)
+    stage_timer.observe("parse", time.perf_counter() - t0, channel_name)
+    for step, seconds in result[3].items(): stage_timer.observe(step, seconds, channel_name)
+    return result
+
+async def json_response(payload, status=200, stage_timer=None):
+    t0 = time.perf_counter()
+    body = await asyncio.to_thread(app.json.dumps, payload)
+    if stage_timer: stage_timer.observe("serialization", time.perf_counter() - t0, keep=False)
+    return Response(body, status=status, mimetype="application/json")
+
+async def no_parse_result():
+    return [], None, None, {}
+
+
+rates_store = RatesStore()
+rates_scheduler = RatesScheduler(scrape_for_scheduler, parse_rates_for_scheduler, CONFIG_DIR, rates_store, get_safe_filename)
 
 
 @app.route('/render', methods=['POST'])
 async def render():
-    data = request.get_json(); url = data.get('url'); selected_items = data.get('selected_items', [])
-    if not url: return jsonify({"error": "URL is required"}), 400
+    data = await request.get_json()
+    stage_timer = StageTimer(data.get('url'))
+    payload, status = await build_render_result(data, stage_timer)
+    return await json_response(payload, status, stage_timer=stage_timer)
+
+async def batch_render_item(data):
+    return await build_render_result(data, StageTimer(data.get('url')))
+
+async def build_render_result(data, stage_timer):
+    url = data.get('url'); selected_items = data.get('selected_items', [])
+    parallel_channels = data.get('parallel_channels')
+    use_cache = data.get('use_cache', True); force_refresh = data.get('force_refresh', False)
+    capture_mode = data.get('capture_mode'); include_timings = data.get('include_timings', False)
+    incremental = data.get('incremental', False)
+    # A cached page hashes exactly as last time, so incremental polls re-scrape unless the caller explicitly asks for the cache.
+    if incremental and 'use_cache' not in data and 'force_refresh' not in data: force_refresh = True
+    if not url: return {"error": "URL is required"}, 400
+    if incremental and not selected_items: return {"error": "Incremental mode needs selected_items"}, 400
+    if capture_mode not in (None, "browser", "xhr"): return {"error": "capture_mode must be 'browser' or 'xhr'"}, 400
     
+    render_started = time.perf_counter()
     processed_agg_item_ids = set()
-    channel_html_data = await get_page_content_for_all_channels(url)
-    res = { "url": url, "aggregated_selectable_items": [], "channels_data_parsed": {}, "channel_specific_info": {}, "global_status_message": None }
+    try: channel_html_data, from_cache = await get_channel_snapshots(url, parallel_channels=parallel_channels, use_cache=use_cache, force_refresh=force_refresh, capture_mode=capture_mode, stage_timer=stage_timer)
+    except PoolBusyError as e_busy: count_render_request(url, 503); return {"error": str(e_busy), "url": url}, 503
+    res = { "url": url, "aggregated_selectable_items": [], "channels_data_parsed": {}, "channel_specific_info": {}, "global_status_message": None, "from_cache": from_cache }
+    if channel_html_data: res["resource_stats"] = channel_html_data[0].get("resource_stats")
 
-    if not channel_html_data: res["global_status_message"] = "No content/channels."; return jsonify({"error": res["global_status_message"], **res}), 500
+    if not channel_html_data: res["global_status_message"] = "No content/channels."; count_render_request(url, 500); return {"error": res["global_status_message"], **res}, 500
 
     user_selected = bool(selected_items)
-    for ch_data_item in channel_html_data:
+    selectors_by_channel = {}
+    for item in selected_items:
+        if item.get('actual_selector'): selectors_by_channel.setdefault(item.get('channel_name'), []).append(item['actual_selector'])
+    if incremental: return await render_incremental(res, channel_html_data, selectors_by_channel, stage_timer, render_started, include_timings)
+    parse_results = await asyncio.gather(*(
+        timed_parse_job(stage_timer, ch.get("channel_name", "Unknown"), parse_channel_snapshot, ch.get("html_content"), url, ch.get("channel_name", "Unknown"), ch.get("page_title", "N/A"),
+                      ch.get("active_tab_id_in_html"), selectors_by_channel.get(ch.get("channel_name", "Unknown"), []))
+        if ch.get("html_content") else no_parse_result() for ch in channel_html_data))
+
+    for ch_data_item, (tags_for_ch, rates_map, p_err, _) in zip(channel_html_data, parse_results):
         ch_name_val = ch_data_item.get("channel_name", "Unknown")
         html_val = ch_data_item.get("html_content")
         title_val = ch_data_item.get("page_title", "N/A")
-        active_tab_id = ch_data_item.get("active_tab_id_in_html") 
 
         ch_info = res["channel_specific_info"].get(ch_name_val, {"page_title": title_val, "parsing_error": None})
         ch_info["page_title"] = title_val
+        ch_info["wait_timings"] = ch_data_item.get("wait_timings", [])
+        ch_info["source"] = ch_data_item.get("source", "browser")
 
         if not html_val:
             err_msg = f"No HTML for '{ch_name_val}'."; ch_info["parsing_error"] = (ch_info["parsing_error"] or "") + err_msg
             res["channel_specific_info"][ch_name_val] = ch_info; continue
         
-        _, tags_for_ch = parse_selectable_tags(html_val, ch_name_val, active_tab_id_in_html=active_tab_id, current_url=url)
         
         for tag_detail in tags_for_ch:
             item_id = (ch_name_val, tag_detail.get('selector'))
@@ -321,9 +428,7 @@ async def render():
         if not tags_for_ch and not user_selected: ch_info["parsing_error"] = (ch_info["parsing_error"] or "") + " No selectable tags."
 
         if user_selected:
-            ch_selectors = [item['actual_selector'] for item in selected_items if item.get('channel_name') == ch_name_val and item.get('actual_selector')]
-            if ch_selectors:
-                rates_map, p_err = parse_rates_from_html(html_val, url, title_val, ch_name_val, ch_selectors)
+            if selectors_by_channel.get(ch_name_val):
                 if rates_map:
                     if ch_name_val not in res["channels_data_parsed"]: res["channels_data_parsed"][ch_name_val] = {}
                     res["channels_data_parsed"][ch_name_val].update(rates_map)
@@ -332,21 +437,164 @@ async def render():
     
     if not res["aggregated_selectable_items"] and not user_selected: res["global_status_message"] = "No selectable items found."
 
-    return jsonify(res)
+    stage_timer.observe("render_total", time.perf_counter() - render_started)
+    if include_timings: res["timings"] = stage_timer.breakdown()
+    count_render_request(url, 200)
+    return res, 200
+
+async def render_incremental(res, channel_html_data, selectors_by_channel, stage_timer, render_started, include_timings):
+    url = res["url"]
+    res = {k: res[k] for k in ("url", "channel_specific_info", "global_status_message", "from_cache")}
+    res.update({"channels_data_delta": {}, "unchanged_selectors": {}})
+    tracked_channels = [ch for ch in channel_html_data if ch.get("html_content") and selectors_by_channel.get(ch.get("channel_name", "Unknown"))]
+    tracked_results = await asyncio.gather(*(
+        parse_rates_tracked(ch["html_content"], url, ch.get("page_title", "N/A"), ch.get("channel_name", "Unknown"), selectors_by_channel[ch.get("channel_name", "Unknown")], "render", stage_timer)
+        for ch in tracked_channels))
+    for ch_data_item, (_, p_err, deltas, unchanged) in zip(tracked_channels, tracked_results):
+        ch_name_val = ch_data_item.get("channel_name", "Unknown")
+        res["channel_specific_info"][ch_name_val] = {"page_title": ch_data_item.get("page_title", "N/A"), "parsing_error": f"ParseErr: {p_err}" if p_err else None,
+                                                     "wait_timings": ch_data_item.get("wait_timings", []), "source": ch_data_item.get("source", "browser")}
+        if deltas: res["channels_data_delta"][ch_name_val] = deltas
+        if unchanged: res["unchanged_selectors"][ch_name_val] = unchanged
+    stage_timer.observe("render_total", time.perf_counter() - render_started)
+    if include_timings: res["timings"] = stage_timer.breakdown()
+    count_render_request(url, 200)
+    return res, 200
+
+batch_manager = BatchRenderManager(batch_render_item)
+
+def ndjson_stream(job, since=0):
+    async def lines():
+        async for result in job.follow(since): yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "done", **job.summary()}, ensure_ascii=False) + "\n"
+    response = Response(lines(), mimetype="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+@app.route('/render/batch', methods=['GET', 'POST'])
+async def render_batch():
+    if request.method == 'GET': return jsonify(batch_manager.snapshot())
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict): return jsonify({"error": "Expected a JSON object"}), 400
+    items = data.get('items') or []; defaults = data.get('defaults') or {}
+    if not isinstance(items, list) or not items: return jsonify({"error": "items must be a non-empty list"}), 400
+    if not isinstance(defaults, dict) or not all(isinstance(item, dict) for item in items): return jsonify({"error": "items and defaults must be JSON objects"}), 400
+    if len(items) > BATCH_MAX_ITEMS: return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+    items = [{**defaults, **item} for item in items]
+    if any(not isinstance(item.get('url'), str) or not item['url'] for item in items): return jsonify({"error": "Every item needs a url"}), 400
+    job = batch_manager.submit(items)
+    # Streamed: one JSON line per URL as it finishes. Otherwise poll /render/batch/<job_id>.
+    if data.get('stream'): return ndjson_stream(job)
+    return jsonify({**job.summary(), "poll_url": f"/render/batch/{job.id}", "stream_url": f"/render/batch/{job.id}/stream"}), 202
+
+@app.route('/render/batch/<job_id>', methods=['GET'])
+async def render_batch_status(job_id):
+    job = batch_manager.get(job_id)
+    if not job: return jsonify({"error": "Unknown job", "job_id": job_id}), 404
+    return await json_response(job.snapshot(since=request.args.get('since', 0, type=int)))
+
+@app.route('/render/batch/<job_id>/stream', methods=['GET'])
+async def render_batch_stream(job_id):
+    job = batch_manager.get(job_id)
+    if not job: return jsonify({"error": "Unknown job", "job_id": job_id}), 404
+    return ndjson_stream(job, since=request.args.get('since', 0, type=int))
+
+@app.route('/rates/stream', methods=['GET'])
+async def rates_stream():
+    # Server-sent events with one row-level delta per changed table; ?url= narrows it to one site.
+    subscriber = change_tracker.subscribe(request.args.get('url'))
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                if subscriber.lagged:
+                    subscriber.lagged = False
+                    yield "event: resync\ndata: {}\n\n"  # deltas were dropped; the client should reload /rates/latest
+                try: event = await asyncio.wait_for(subscriber.queue.get(), timeout=CHANGE_STREAM_KEEPALIVE_S)
+                except asyncio.TimeoutError: yield ": keepalive\n\n"; continue
+                yield f"event: delta\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally: change_tracker.unsubscribe(subscriber)
+
+    response = Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+@app.route('/change-tracker', methods=['GET', 'DELETE'])
+async def change_tracker_info():
+    if request.method == 'DELETE':
+        url = request.args.get('url')
+        if not url: return jsonify({"error": "URL is required"}), 400
+        change_tracker.invalidate(url)
+    return jsonify(change_tracker.snapshot())
+
+@app.route('/snapshot-cache', methods=['GET', 'DELETE'])
+async def snapshot_cache_info():
+    if request.method == 'DELETE':
+        url = request.args.get('url')
+        if not url: return jsonify({"error": "URL is required"}), 400
+        snapshot_cache.invalidate(url)
+    return jsonify(snapshot_cache.snapshot())
+
+@app.route('/browser-pool', methods=['GET'])
+async def browser_pool_info():
+    return jsonify(get_browser_pool().snapshot())
+
+@app.route('/debug-snapshots', methods=['GET'])
+async def debug_snapshots_info():
+    return jsonify(debug_writer.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    body, content_type = metrics_exposition()
+    return Response(body, content_type=content_type)
+
+@app.route('/wait-stats', methods=['GET'])
+async def wait_stats():
+    return jsonify(wait_stats_snapshot())
 
 @app.route('/save-data', methods=['POST'])
-def save_data():
-    data = request.get_json()
+async def save_data():
+    data = await request.get_json()
     url = data.get('url'); currency_data = data.get('currency_data', {}) 
+    poll_interval_s = data.get('poll_interval_s')
     if not url or not currency_data: return jsonify({"error": "URL and currency data required"}), 400
     
     sf_name = get_safe_filename(url)
     cf_path = os.path.join(CONFIG_DIR, f"{sf_name}_rates_config.json")
     config = {"url": url, "saved_market_data_by_channel": currency_data}
+    try: poll_interval_s = parse_poll_interval(poll_interval_s)
+    except (TypeError, ValueError): return jsonify({"error": "poll_interval_s must be a positive number of seconds"}), 400
+    if poll_interval_s: config["poll_interval_s"] = poll_interval_s
     try:
-        with open(cf_path, 'w', encoding='utf-8') as f: json.dump(config, f, ensure_ascii=False, indent=2)
+        await asyncio.to_thread(write_json_file, cf_path, config)
         return jsonify({"message": "Config saved", "file": cf_path})
     except Exception as e: return jsonify({"error": f"Save failed: {str(e)}"}), 500
 
+@app.route('/rates/latest', methods=['GET'])
+async def rates_latest():
+    url = request.args.get('url')
+    if not url: return jsonify({"rates": rates_store.all(), "schedule": rates_scheduler.snapshot()})
+    record = rates_store.get(url)
+    if not record: return jsonify({"error": "No stored rates for this URL", "url": url}), 404
+    return jsonify(record)
+
+def write_json_file(path, payload):
+    with open(path, 'w', encoding='utf-8') as f: json.dump(payload, f, ensure_ascii=False, indent=2)
+
+@app.before_serving
+async def start_background_services():
+    if SCHEDULER_ENABLED: rates_scheduler.start()
+
+@app.after_serving
+async def stop_background_services():
+    rates_scheduler.stop()
+    await batch_manager.close()
+    await debug_writer.close()
+    await close_http_client()
+    await get_browser_pool().close()
+    if parse_executor: parse_executor.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == '__main__':
+    # Development server; in production run the ASGI app with `hypercorn app:app`.
     app.run(debug=True, host='0.0.0.0', port=5000)
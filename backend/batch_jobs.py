@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import asyncio
+import datetime
+import os
+import random
+import time
+import traceback
+import uuid
+
+from scheduler import shared_domain_limiter
+
+BATCH_MAX_ITEMS = int(os.environ.get("SCRAPER_BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("SCRAPER_BATCH_MAX_CONCURRENCY", "4"))
+BATCH_DOMAIN_MIN_GAP_S = float(os.environ.get("SCRAPER_BATCH_DOMAIN_MIN_GAP_S", "2"))
+BATCH_MAX_ATTEMPTS = int(os.environ.get("SCRAPER_BATCH_MAX_ATTEMPTS", "3"))
+BATCH_BACKOFF_BASE_S = float(os.environ.get("SCRAPER_BATCH_BACKOFF_BASE_S", "5"))
+BATCH_BACKOFF_MAX_S = float(os.environ.get("SCRAPER_BATCH_BACKOFF_MAX_S", "60"))
+BATCH_MAX_JOBS = int(os.environ.get("SCRAPER_BATCH_MAX_JOBS", "50"))
+
+# 500: nothing scraped, 503: browser pool saturated. Both usually clear up after a pause.
+RETRYABLE_STATUSES = frozenset((500, 503))
+BLOCKED_MARKERS = ("Page blocked", "Engellendi", "Blocked")
+
+
+def blocked_reason(payload):
+    for ch_name, ch_info in (payload.get("channel_specific_info") or {}).items():
+        err = (ch_info or {}).get("parsing_error") or ""
+        if any(marker in err for marker in BLOCKED_MARKERS): return f"{ch_name}: {err.strip()}"
+    return None
+
+
+def backoff_delay(attempt, base_s=BATCH_BACKOFF_BASE_S, max_s=BATCH_BACKOFF_MAX_S):
+    return min(max_s, base_s * 2 ** (attempt - 1)) * random.uniform(0.75, 1.25)
+
+
+class BatchJob:
+    def __init__(self, items):
+        self.id = uuid.uuid4().hex[:12]
+        self.items = items
+        self.created_at = datetime.datetime.now().isoformat()
+        self.finished_at = None
+        self.results = []  # in completion order
+        self.tasks = []
+        self._cond = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return len(self.results) >= len(self.items)
+
+    async def add_result(self, result):
+        async with self._cond:
+            self.results.append(result)
+            if self.finished: self.finished_at = datetime.datetime.now().isoformat()
+            self._cond.notify_all()
+
+    async def follow(self, since=0):
+        pos = since
+        while True:
+            async with self._cond: await self._cond.wait_for(lambda: len(self.results) > pos or self.finished)
+            while pos < len(self.results): yield self.results[pos]; pos += 1
+            if self.finished: return
+
+    def summary(self):
+        ok = sum(1 for r in self.results if r["status"] == 200)
+        return {"job_id": self.id, "created_at": self.created_at, "finished_at": self.finished_at, "total": len(self.items),
+                "completed": len(self.results), "succeeded": ok, "failed": len(self.results) - ok, "done": self.finished}
+
+    def snapshot(self, since=0):
+        return {**self.summary(), "results": self.results[since:], "next_since": len(self.results)}
+
+
+class BatchRenderManager:
+    # render_fn(data) -> (payload, status), the same work /render does for one URL.
+    def __init__(self, render_fn, max_concurrency=BATCH_MAX_CONCURRENCY, domain_min_gap_s=BATCH_DOMAIN_MIN_GAP_S,
+                 max_attempts=BATCH_MAX_ATTEMPTS, max_jobs=BATCH_MAX_JOBS, domain_limiter=None):
+        self.render_fn = render_fn
+        self.max_concurrency = max(1, max_concurrency)
+        self.domain_min_gap_s = domain_min_gap_s
+        # Shared with the scheduler: the per-domain cap counts scheduled polls and batch items together.
+        self.domain_limiter = domain_limiter or shared_domain_limiter
+        self.max_attempts = max(1, max_attempts)
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._semaphore = None
+        self.stats = {"jobs": 0, "items": 0, "attempts": 0, "retries": 0, "blocked": 0}
+
+    def submit(self, items):
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        job = BatchJob(items)
+        self._jobs[job.id] = job; self._evict_finished()
+        self.stats["jobs"] += 1; self.stats["items"] += len(items)
+        job.tasks = [asyncio.ensure_future(self._run_item(job, index, item)) for index, item in enumerate(items)]
+        print(f"[BATCH] Job {job.id}: {len(items)} URL(s) queued")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _evict_finished(self):
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished][:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    async def _render_once(self, item):
+        # Domain cap and gap first, so a URL waiting on its domain doesn't hold one of the shared slots.
+        async with self.domain_limiter.slot(item["url"], self.domain_min_gap_s), self._semaphore:
+            self.stats["attempts"] += 1
+            return await self.render_fn(item)
+
+    async def _run_item(self, job, index, item):
+        started = time.monotonic(); attempt = 0; errors = []
+        payload, status = None, None
+        while True:
+            attempt += 1
+            try:
+                payload, status = await self._render_once(item)
+                reason = blocked_reason(payload) if status == 200 else None
+                if reason: self.stats["blocked"] += 1; errors.append(f"blocked ({reason})")
+                elif status in RETRYABLE_STATUSES: errors.append(payload.get("error") or f"HTTP {status}")
+                else: break
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                payload, status = {"error": str(e), "url": item["url"]}, 500; errors.append(str(e)); traceback.print_exc()
+            if attempt >= self.max_attempts: break
+            delay = backoff_delay(attempt)
+            print(f"[BATCH] Job {job.id} {item['url']}: attempt {attempt} failed ({errors[-1]}), retrying in {delay:.1f}s")
+            self.stats["retries"] += 1
+            # Retries bypass the snapshot cache so a blocked or empty page isn't served again.
+            item = {**item, "force_refresh": True}
+            await asyncio.sleep(delay)
+        await job.add_result({"index": index, "url": item["url"], "status": status, "attempts": attempt, "errors": errors,
+                              "duration_s": round(time.monotonic() - started, 2), "result": payload})
+
+    async def close(self):
+        tasks = [task for job in self._jobs.values() for task in job.tasks if not task.done()]
+        for task in tasks: task.cancel()
+        if tasks: await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self):
+        return {"max_concurrency": self.max_concurrency, "domain_concurrency": self.domain_limiter.concurrency, "max_attempts": self.max_attempts,
+                "jobs": [job.summary() for job in self._jobs.values()], **self.stats}
@@ -0,0 +1,120 @@
+import argparse
+import random
+import time
+
+from html_engine import ParsedSnapshot, parse_selectable_tags_bs4, parse_rates_from_html_bs4, parse_selectable_tags_lxml, parse_rates_from_html_lxml
+
+CURRENCIES = ["USD", "EUR", "GBP", "CHF", "JPY", "SAR", "AUD", "CAD", "DKK", "SEK", "NOK", "KWD", "RUB", "CNY", "AED", "QAR"]
+
+
+def page_filler(rng, blocks):
+    parts = ['<header><nav><ul>' + ''.join(f'<li><a href="/m{i}">Menü {i}</a></li>' for i in range(60)) + '</ul></nav></header>']
+    for b in range(blocks):
+        parts.append(f'<div class="promo p{b}"><!-- kampanya {b} --><h3>Kampanya {b}</h3><p>{"Lorem ipsum dolor sit amet. " * rng.randint(3, 12)}</p>'
+                     f'<img src="/img/{b}.png"><script>window.dl=window.dl||[];dl.push({{b:{b}}});</script></div>')
+    parts.append('<footer>' + ''.join(f'<p>Footer {i} &copy; 2024</p>' for i in range(40)) + '</footer>')
+    return ''.join(parts)
+
+
+def rate_rows(rng, rows, unit=" TL", first_col_tag="td"):
+    out = []
+    for i in range(rows):
+        code = CURRENCIES[i % len(CURRENCIES)] + ("" if i < len(CURRENCIES) else str(i))
+        buy = rng.uniform(0.1, 45); sell = buy * 1.02
+        out.append(f'<tr><{first_col_tag}><span class="flag"></span> {code} </{first_col_tag}><td>{buy:.4f}'.replace('.', ',') + f'{unit}</td>'
+                   f'<td>{sell:.4f}'.replace('.', ',') + f'{unit}</td><td>%{rng.uniform(-2, 2):.2f}</td></tr>')
+    return ''.join(out)
+
+
+def isbank_page(rng, rows, blocks):
+    select = '<select id="fxRateType">' + ''.join(f'<option value="{v}">{n}</option>' for v, n in [("1", "Şube"), ("2", "İnternet"), ("3", "Efektif")]) + '</select>'
+    table = ('<div class="dk_MC"><table class="dk_MT rates"><thead><tr><th></th><th>Alış</th><th>Satış</th><th>Değişim</th></tr></thead>'
+             f'<tbody>{rate_rows(rng, rows)}</tbody></table>'
+             '<table class="dk_MT dk_small"><tr><td>Güncelleme</td><td>10:42</td></tr></table></div>')
+    return f'<!DOCTYPE html><html><head><title>Döviz Kurları</title><style>td{{color:red}}</style></head><body>{select}{page_filler(rng, blocks)}{table}{page_filler(rng, blocks)}</body></html>'
+
+
+def tabbed_page(rng, rows, blocks, panes=4):
+    tabs = '<ul class="nav nav-tabs">' + ''.join(f'<li><a data-toggle="pill" href="#pane{p}">Kanal {p}</a></li>' for p in range(panes)) + '</ul>'
+    pane_html = []
+    for p in range(panes):
+        header = '<tr><th>Döviz</th><th>Alış</th><th>Satış</th><th>Fark</th></tr>'
+        # Pane 1 repeats its header row inside tbody, pane 2 has no thead and nests a table in a cell.
+        body = rate_rows(rng, rows, unit=" USD" if p == 3 else " TL")
+        if p == 0: table = f'<table class="table table-striped rates-{p}"><thead>{header}</thead><tbody>{body}</tbody></table>'
+        elif p == 1: table = f'<table class="table"><tbody>{header}{body}{header}</tbody></table>'
+        elif p == 2: table = f'<table id="tbl{p}">{header}{body}<tr><td><table><tr><td>iç</td></tr></table></td><td>1,0</td></tr></table>'
+        else: table = f'<table class="table"><thead><tr><th></th><th> </th><th>Satış<script>x=1</script></th><th>Fark</th></tr></thead><tbody>{body}</tbody></table>'
+        pane_html.append(f'<div class="tab-pane{" active show" if p == 0 else ""}" id="pane{p}">{table}</div>')
+    picker = '<div class="datetimepicker"><table><tr><th>Pzt</th><th>Sal</th></tr><tr><td>1</td><td>2</td></tr></table></div>'
+    return f'<html><head><title>Kurlar</title></head><body>{tabs}{page_filler(rng, blocks)}<div class="tab-content">{"".join(pane_html)}</div>{picker}{page_filler(rng, blocks)}</body></html>'
+
+
+def borsa_page(rng, rows, blocks):
+    tables = ''.join(f'<table id="indexpage-{n}" class="table"><thead><tr><th>Endeks</th><th>Son</th><th>Değişim %</th></tr></thead><tbody>'
+                     + ''.join(f'<tr><td>XU{n}{i:03d}</td><td>{rng.uniform(1000, 9000):.2f}'.replace('.', ',') + f'</td><td>{rng.uniform(-3, 3):.2f} %</td></tr>' for i in range(rows))
+                     + '</tbody></table>' for n in ("bist", "sektor", "tematik"))
+    return f'<html><head><title>Borsa İstanbul</title></head><body>{page_filler(rng, blocks)}{tables}{page_filler(rng, blocks)}</body></html>'
+
+
+def kuveytturk_page(rng, rows, blocks):
+    table = ('<div class="table-responsive"><table class="table table-portal"><thead><tr><th>Döviz Cinsi</th><th>Alış</th><th>Satış</th><th>Fark</th></tr></thead>'
+             f'<tbody>{rate_rows(rng, rows, first_col_tag="th")}</tbody></table></div>')
+    return f'<html><head><title>Kuveyt Türk</title></head><body>{page_filler(rng, blocks)}{table}<table class="table"><tr><td>x</td></tr></table>{page_filler(rng, blocks)}</body></html>'
+
+
+def build_corpus(rows, blocks, seed=7):
+    rng = random.Random(seed)
+    return [
+        ("isbank", "https://www.isbank.com.tr/doviz-kurlari", isbank_page(rng, rows, blocks), [("Şube", "isbank_content_for_1")]),
+        ("tabbed", "https://www.example-bank.com/kurlar", tabbed_page(rng, rows, blocks), [(f"Kanal {p}", f"pane{p}") for p in range(4)]),
+        ("borsaistanbul", "https://www.borsaistanbul.com/tr/endeksler", borsa_page(rng, rows, blocks), [("Default Channel", None)]),
+        ("kuveytturk", "https://www.kuveytturk.com.tr/finans-portali", kuveytturk_page(rng, rows, blocks), [("Default Channel", None)]),
+    ]
+
+
+def run_bs4_path(html, url, channels):
+    # The pre-engine flow: every call builds its own BeautifulSoup of the full page.
+    out = []
+    for ch_name, tab_id in channels:
+        _, tags = parse_selectable_tags_bs4(html, ch_name, active_tab_id_in_html=tab_id, current_url=url)
+        out.append((tags, parse_rates_from_html_bs4(html, url, "Kurlar", ch_name, [t["selector"] for t in tags])))
+    return out
+
+
+def run_lxml_path(html, url, channels):
+    out = []
+    for ch_name, tab_id in channels:
+        snapshot = ParsedSnapshot(html)
+        _, tags = parse_selectable_tags_lxml(snapshot, ch_name, active_tab_id_in_html=tab_id, current_url=url)
+        out.append((tags, parse_rates_from_html_lxml(snapshot, url, "Kurlar", ch_name, [t["selector"] for t in tags])))
+    return out
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); result = fn(); times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare the BS4 and lxml parsing paths on synthetic large bank pages.")
+    ap.add_argument("--rows", type=int, default=120, help="rate rows per table")
+    ap.add_argument("--blocks", type=int, default=400, help="filler blocks before and after the tables")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    mismatches = 0
+    print(f"{'page':<15}{'KB':>8}{'bs4 ms':>10}{'lxml ms':>10}{'speedup':>9}  output")
+    for name, url, html, channels in build_corpus(args.rows, args.blocks):
+        t_bs4, out_bs4 = best_of(lambda: run_bs4_path(html, url, channels), args.repeat)
+        t_lxml, out_lxml = best_of(lambda: run_lxml_path(html, url, channels), args.repeat)
+        same = out_bs4 == out_lxml
+        mismatches += not same
+        print(f"{name:<15}{len(html) / 1024:>8.0f}{t_bs4 * 1000:>10.1f}{t_lxml * 1000:>10.1f}{t_bs4 / t_lxml:>8.1f}x  {'identical' if same else 'MISMATCH'}")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote
+import argparse
+import asyncio
+import datetime
+import glob
+import json
+import os
+import re
+import resource
+import shutil
+import threading
+import time
+import tracemalloc
+
+import html_engine
+from html_engine import ParsedSnapshot, parse_selectable_tags, parse_rates_from_html
+from debug_writer import read_debug_snapshot, parse_snapshot_header, compress_snapshot
+from change_tracker import keyed_rows, diff_rows
+
+SNAPSHOT_DIR = "debug_channel_html_snapshots"
+# The debug writer evicts its oldest captures to stay under its disk budget, so the benchmark keeps its own copies.
+CORPUS_DIR = "bench_corpus"
+GOLDEN_DIR = "bench_golden"
+SNAPSHOT_PATTERNS = ("*.html", "*.html.gz", "*.html.zst")
+SNAPSHOT_SUFFIX_RE = re.compile(r'\.html(?:\.gz|\.zst)?$')
+UNSAFE_NAME_CHARS_RE = re.compile(r'[^\w.-]')
+
+
+def load_corpus(snapshot_dir, include_all=False, limit=None):
+    # Only post-interaction captures are what /render parses; --all adds initial loads and failed interactions.
+    corpus = []
+    paths = sorted(p for pattern in SNAPSHOT_PATTERNS for p in glob.glob(os.path.join(snapshot_dir, pattern)))
+    for path in paths:
+        try: html = read_debug_snapshot(path)
+        except Exception as e: print(f"[BENCH_WARN] Unreadable snapshot {path}: {e}"); continue
+        header = parse_snapshot_header(html)
+        if not header: print(f"[BENCH_WARN] No DEBUG header in {path}, skipped"); continue
+        if not include_all and (not header["stage"].startswith("content_after_interaction") or header["stage"].endswith("_failed")): continue
+        corpus.append({"name": SNAPSHOT_SUFFIX_RE.sub("", os.path.basename(path)), "path": path, "html": html, **header})
+        if limit and len(corpus) >= limit: break
+    return corpus
+
+
+def import_snapshots(source_dir, corpus_dir, include_all=False, limit=None):
+    os.makedirs(corpus_dir, exist_ok=True); copied = 0
+    for entry in load_corpus(source_dir, include_all=include_all, limit=limit):
+        target = os.path.join(corpus_dir, os.path.basename(entry["path"]))
+        if not os.path.exists(target): shutil.copy2(entry["path"], target); copied += 1
+    return copied
+
+
+def parse_entry(entry, table_latencies):
+    snapshot = ParsedSnapshot(entry["html"])
+    _, tags = parse_selectable_tags(snapshot, entry["channel_name"], active_tab_id_in_html=entry["active_tab_id"], current_url=entry["url"])
+    rates, errors = {}, []
+    for tag in tags:
+        t0 = time.perf_counter()
+        rates_map, p_err = parse_rates_from_html(snapshot, entry["url"], entry["page_title"], entry["channel_name"], [tag["selector"]])
+        table_latencies.append(time.perf_counter() - t0)
+        rates.update(rates_map)
+        if p_err: errors.append(p_err)
+    return {"tags": [{"selector": t["selector"], "col_count": t["col_count"]} for t in tags], "rates": rates, "errors": errors}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def run_parse_benchmark(corpus, repeat):
+    outputs, page_times, table_latencies = {}, [], []
+    for entry in corpus:
+        best = None
+        for _ in range(repeat):
+            latencies = []
+            t0 = time.perf_counter(); output = parse_entry(entry, latencies); elapsed = time.perf_counter() - t0
+            if best is None or elapsed < best[0]: best = (elapsed, latencies)
+        page_times.append(best[0]); table_latencies.extend(best[1]); outputs[entry["name"]] = output
+    return outputs, page_times, sorted(table_latencies)
+
+
+def measure_peak_memory(corpus):
+    # tracemalloc only sees Python allocations (BS4 trees, row dicts); lxml trees show up in max RSS instead.
+    peaks = []
+    tracemalloc.start()
+    for entry in corpus:
+        tracemalloc.reset_peak()
+        parse_entry(entry, [])
+        peaks.append(tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return max(peaks, default=0), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def golden_path(golden_dir, name):
+    return os.path.join(golden_dir, f"{name}.json")
+
+
+def compare_with_golden(outputs, corpus, golden_dir, update):
+    mismatches, missing = 0, 0
+    if update: os.makedirs(golden_dir, exist_ok=True)
+    for entry in corpus:
+        name = entry["name"]; output = outputs[name]; path = golden_path(golden_dir, name)
+        if update:
+            with open(path, "w", encoding="utf-8") as f: json.dump({"url": entry["url"], "channel_name": entry["channel_name"], **output}, f, ensure_ascii=False, indent=2)
+            continue
+        try:
+            with open(path, encoding="utf-8") as f: golden = json.load(f)
+        except FileNotFoundError: missing += 1; continue
+        problems = []
+        if golden["tags"] != output["tags"]: problems.append(f"tags: {[t['selector'] for t in golden['tags']]} -> {[t['selector'] for t in output['tags']]}")
+        for sel in sorted(set(golden["rates"]) | set(output["rates"])):
+            delta = diff_rows(keyed_rows(golden["rates"].get(sel, [])), keyed_rows(output["rates"].get(sel, [])))
+            if any(delta.values()):
+                problems.append(f"{sel}: +{len(delta['added'])} -{len(delta['removed'])} ~{len(delta['changed'])} rows")
+                for change in delta["changed"][:3]: problems.append(f"    {change['key']}: {change['fields']}")
+        if golden.get("errors", []) != output["errors"]: problems.append(f"errors: {golden.get('errors')} -> {output['errors']}")
+        if problems:
+            mismatches += 1
+            print(f"[GOLDEN] MISMATCH {name}"); print("\n".join(f"    {p}" for p in problems))
+    return mismatches, missing
+
+
+class SnapshotServer:
+    # Serves each snapshot at /<name>.html so the browser path can be timed without the network.
+    def __init__(self, corpus, host="127.0.0.1", port=0):
+        pages = {f"/{entry['name']}.html": entry["html"].encode("utf-8") for entry in corpus}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(unquote(self.path.split("?", 1)[0]))
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                if body: self.wfile.write(body)
+
+            def log_message(self, *args): pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url_for(self, entry):
+        return f"{self.base_url}/{quote(entry['name'])}.html"
+
+    def __enter__(self):
+        self._thread.start(); return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown(); self.httpd.server_close()
+
+
+async def run_e2e_benchmark(corpus, server):
+    # The app's full scrape flow (pool, stealth, resource profile, waits, channel discovery) against the local copies.
+    # Anything that isn't the local server is blocked, so pages referencing live CDNs don't reach the network.
+    import resource_profile
+    resource_profile.DOMAIN_RESOURCE_OVERRIDES["127.0.0.1"] = {"allow_url_patterns": [server.base_url], "block_url_patterns": ["://"]}
+    import app
+    from metrics import StageTimer
+    # debug_writer read its env toggle when this module imported it, so switch the app's writer off directly:
+    # captures of 127.0.0.1 pages would land in the corpus directory and eat its disk budget.
+    app.debug_writer.enabled = False
+    rows = []
+    try:
+        for entry in corpus:
+            local_url = server.url_for(entry); stage_timer = StageTimer(local_url)
+            t0 = time.perf_counter()
+            channels = await app.get_page_content_for_all_channels(local_url, stage_timer=stage_timer)
+            t_scrape = time.perf_counter() - t0
+            for ch in channels:
+                latencies = []
+                parse_entry({**entry, "html": ch["html_content"], "channel_name": ch["channel_name"], "active_tab_id": ch["active_tab_id_in_html"]}, latencies)
+            rows.append((entry["name"], t_scrape, time.perf_counter() - t0, len(channels), stage_timer.breakdown()["totals_ms"]))
+    finally:
+        await app.debug_writer.close()
+        await app.get_browser_pool().close()
+        if app.parse_executor: app.parse_executor.shutdown(wait=False, cancel_futures=True)
+    return rows
+
+
+def write_synthetic_corpus(target_dir, rows, blocks):
+    # Seeds a snapshot directory from bench_parse's generated pages, in the debug writer's file format.
+    from bench_parse import build_corpus
+    os.makedirs(target_dir, exist_ok=True)
+    now = datetime.datetime.now()
+    for name, url, html, channels in build_corpus(rows, blocks):
+        for ch_name, tab_id in channels:
+            filename = f"synthetic_{name}_{UNSAFE_NAME_CHARS_RE.sub('_', ch_name)}_stg_content_after_interaction_with_bench.html.gz"
+            header = f"<!-- DEBUG: URL:{url} CH:{ch_name} PGTITLE:Kurlar STG:content_after_interaction_with_bench TAB:{tab_id or ''} TS:{now.isoformat()} FILE:{filename} -->\n\n"
+            with open(os.path.join(target_dir, filename), "wb") as f: f.write(compress_snapshot((header + html).encode("utf-8"), "gzip"))
+    print(f"Wrote synthetic snapshots to {target_dir}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay saved HTML snapshots through the parsers: throughput, latency, memory and golden diffs.")
+    ap.add_argument("--corpus", "--snapshots", default=CORPUS_DIR, help="directory of .html/.html.gz/.html.zst snapshots to benchmark")
+    ap.add_argument("--import", dest="import_from", nargs="?", const=SNAPSHOT_DIR, metavar="DIR",
+                    help=f"first copy new snapshots from DIR (default {SNAPSHOT_DIR}) into the corpus")
+    ap.add_argument("--golden", default=GOLDEN_DIR, help="directory of golden outputs, one JSON per snapshot")
+    ap.add_argument("--update-golden", action="store_true", help="rewrite the golden outputs from this run")
+    ap.add_argument("--engine", choices=("lxml", "bs4"), default=html_engine.PARSER_ENGINE)
+    ap.add_argument("--repeat", type=int, default=3, help="parse each snapshot N times and keep the fastest")
+    ap.add_argument("--limit", type=int, default=None, help="only the first N snapshots")
+    ap.add_argument("--all", action="store_true", help="include initial-load and failed-interaction snapshots")
+    ap.add_argument("--e2e", action="store_true", help="also time the Playwright scrape against a local static server")
+    ap.add_argument("--serve", action="store_true", help="only serve the snapshots over HTTP until interrupted")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--write-synthetic", metavar="DIR", help="write bench_parse's synthetic pages as snapshots into DIR and exit")
+    args = ap.parse_args()
+
+    if args.write_synthetic: write_synthetic_corpus(args.write_synthetic, 120, 400); return
+    html_engine.PARSER_ENGINE = args.engine
+    if args.import_from: print(f"Copied {import_snapshots(args.import_from, args.corpus, include_all=args.all, limit=args.limit)} new snapshot(s) from {args.import_from} into {args.corpus}")
+    corpus = load_corpus(args.corpus, include_all=args.all, limit=args.limit)
+    if not corpus: print(f"No snapshots found in {args.corpus} (add some with --import)"); raise SystemExit(2)
+
+    if args.serve:
+        with SnapshotServer(corpus, port=args.port) as server:
+            for entry in corpus: print(f"{server.url_for(entry)}  <- {entry['url']} / {entry['channel_name']}")
+            try: threading.Event().wait()
+            except KeyboardInterrupt: pass
+        return
+
+    outputs, page_times, table_latencies = run_parse_benchmark(corpus, max(1, args.repeat))
+    total_s = sum(page_times); total_kb = sum(len(entry["html"]) for entry in corpus) / 1024
+    print(f"engine={args.engine}  snapshots={len(corpus)}  tables={len(table_latencies)}  corpus={total_kb:.0f} KB")
+    print(f"pages/sec: {len(corpus) / total_s:.1f}   ({total_s * 1000:.1f} ms total, {total_kb / total_s / 1024:.1f} MB/s)")
+    print("per-table ms: " + "  ".join(f"p{p}={percentile(table_latencies, p) * 1000:.2f}" for p in (50, 90, 99)) +
+          f"  max={(table_latencies[-1] if table_latencies else 0) * 1000:.2f}")
+    peak_py, max_rss = measure_peak_memory(corpus)
+    print(f"peak memory: {peak_py / 1024 / 1024:.1f} MB python heap (max per page), {max_rss / 1024 / 1024:.1f} MB process max RSS")
+
+    mismatches, missing = compare_with_golden(outputs, corpus, args.golden, args.update_golden)
+    if args.update_golden: print(f"Golden outputs written to {args.golden}")
+    else: print(f"golden: {len(corpus) - mismatches - missing} match, {mismatches} mismatch, {missing} without golden")
+
+    if args.e2e:
+        with SnapshotServer(corpus, port=args.port) as server:
+            rows = asyncio.run(run_e2e_benchmark(corpus, server))
+        print(f"\n{'snapshot':<60}{'scrape ms':>10}{'+parse ms':>10}{'ch':>4}  stages")
+        for name, t_scrape, t_total, ch_count, stages in rows:
+            print(f"{name[:58]:<60}{t_scrape * 1000:>10.0f}{t_total * 1000:>10.0f}{ch_count:>4}  {', '.join(f'{k}={v:.0f}' for k, v in stages.items())}")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
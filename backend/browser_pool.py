@@ -0,0 +1,139 @@
+from playwright.async_api import async_playwright
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import time
+
+POOL_BROWSERS = int(os.environ.get("SCRAPER_POOL_BROWSERS", "2"))
+POOL_CONTEXTS_PER_BROWSER = int(os.environ.get("SCRAPER_POOL_CONTEXTS_PER_BROWSER", "2"))
+POOL_CONTEXT_MAX_USES = int(os.environ.get("SCRAPER_POOL_CONTEXT_MAX_USES", "20"))
+POOL_MAX_WAITERS = int(os.environ.get("SCRAPER_POOL_MAX_WAITERS", "16"))
+POOL_LEASE_TIMEOUT_S = float(os.environ.get("SCRAPER_POOL_LEASE_TIMEOUT_S", "120"))
+
+USER_AGENT_STRING = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+CONTEXT_OPTIONS = {"user_agent": USER_AGENT_STRING, "viewport": {'width': 1920, 'height': 1080}, "java_script_enabled": True, "ignore_https_errors": True}
+
+
+class PoolBusyError(Exception):
+    pass
+
+
+class ContextSlot:
+    def __init__(self, browser_index):
+        self.browser_index = browser_index
+        self.context = None
+        self.uses = 0
+        self.broken = False
+        self.wait_s = 0.0  # time the current lease spent queued for this slot
+
+    def mark_broken(self):
+        self.broken = True
+
+
+class BrowserPool:
+    def __init__(self, browsers=POOL_BROWSERS, contexts_per_browser=POOL_CONTEXTS_PER_BROWSER,
+                 max_uses=POOL_CONTEXT_MAX_USES, max_waiters=POOL_MAX_WAITERS, lease_timeout=POOL_LEASE_TIMEOUT_S):
+        self.browser_count = max(1, browsers)
+        self.contexts_per_browser = max(1, contexts_per_browser)
+        self.max_uses = max(1, max_uses)
+        self.max_waiters = max(0, max_waiters)
+        self.lease_timeout = lease_timeout
+        self._playwright = None
+        self._browsers = [None] * self.browser_count
+        self._browser_locks = [asyncio.Lock() for _ in range(self.browser_count)]
+        self._idle = None
+        self._waiting = 0
+        self._start_lock = asyncio.Lock()
+        self.stats = {"leases": 0, "contexts_created": 0, "contexts_recycled": 0, "browsers_launched": 0, "rejected": 0}
+
+    @property
+    def capacity(self):
+        return self.browser_count * self.contexts_per_browser
+
+    async def start(self):
+        async with self._start_lock:
+            if self._idle is not None: return
+            self._playwright = await async_playwright().start()
+            self._idle = asyncio.Queue()
+            # Interleave slots so consecutive leases spread across browsers.
+            for _ in range(self.contexts_per_browser):
+                for b_idx in range(self.browser_count): self._idle.put_nowait(ContextSlot(b_idx))
+
+    async def close(self):
+        if self._idle is None: return
+        while not self._idle.empty():
+            slot = self._idle.get_nowait()
+            await self._close_context(slot)
+        for b_idx, browser in enumerate(self._browsers):
+            if browser:
+                try: await browser.close()
+                except Exception as e: print(f"[POOL_WARN] Browser #{b_idx} close failed: {e}")
+            self._browsers[b_idx] = None
+        if self._playwright: await self._playwright.stop()
+        self._playwright = None; self._idle = None
+
+    async def _get_browser(self, b_idx):
+        async with self._browser_locks[b_idx]:
+            browser = self._browsers[b_idx]
+            if browser and browser.is_connected(): return browser
+            browser = await self._playwright.chromium.launch(headless=True)
+            self._browsers[b_idx] = browser
+            self.stats["browsers_launched"] += 1
+            print(f"[POOL] Launched browser #{b_idx}")
+            return browser
+
+    async def _close_context(self, slot):
+        if slot.context:
+            try: await slot.context.close()
+            except Exception as e: print(f"[POOL_WARN] Context close failed (browser #{slot.browser_index}): {e}")
+        slot.context = None; slot.uses = 0; slot.broken = False
+
+    async def _prepare_slot(self, slot):
+        browser = self._browsers[slot.browser_index]
+        if slot.context and (not browser or not browser.is_connected()): slot.context = None; slot.uses = 0
+        if slot.context is None:
+            browser = await self._get_browser(slot.browser_index)
+            slot.context = await browser.new_context(**CONTEXT_OPTIONS)
+            self.stats["contexts_created"] += 1
+        return slot
+
+    async def _release(self, slot):
+        slot.uses += 1
+        if slot.broken or slot.uses >= self.max_uses:
+            self.stats["contexts_recycled"] += 1
+            await self._close_context(slot)
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def lease(self):
+        await self.start()
+        if self._idle.empty() and self._waiting >= self.max_waiters:
+            self.stats["rejected"] += 1
+            raise PoolBusyError(f"Browser pool busy ({self.capacity} in use, {self._waiting} waiting).")
+        self._waiting += 1; queued_at = time.perf_counter()
+        try: slot = await asyncio.wait_for(self._idle.get(), timeout=self.lease_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise PoolBusyError(f"Timed out after {self.lease_timeout}s waiting for a browser context.")
+        finally: self._waiting -= 1
+        slot.wait_s = time.perf_counter() - queued_at
+        try:
+            await self._prepare_slot(slot)
+            self.stats["leases"] += 1
+            yield slot
+        except BaseException:
+            slot.mark_broken(); raise
+        finally:
+            await self._release(slot)
+
+    def snapshot(self):
+        in_use = self.capacity - (self._idle.qsize() if self._idle is not None else self.capacity)
+        return {"capacity": self.capacity, "in_use": in_use, "waiting": self._waiting, **self.stats}
+
+
+# Created at import and started lazily on the server's event loop; closed from the app's after_serving hook.
+browser_pool = BrowserPool()
+
+
+def get_browser_pool():
+    return browser_pool
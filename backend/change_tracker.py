@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import asyncio
+import datetime
+import os
+import threading
+
+CHANGE_TRACKER_MAX_TABLES = int(os.environ.get("SCRAPER_CHANGE_TRACKER_MAX_TABLES", "2000"))
+CHANGE_STREAM_QUEUE_MAX = int(os.environ.get("SCRAPER_CHANGE_STREAM_QUEUE_MAX", "256"))
+
+
+def row_key(row):
+    # Rows are keyed by their first column (item_name on tables with a label column).
+    if "item_name" in row: return str(row["item_name"])
+    return str(next(iter(row.values()), ""))
+
+
+def keyed_rows(rows):
+    keyed = OrderedDict()
+    for row in rows:
+        key = base = row_key(row); n = 1
+        while key in keyed: n += 1; key = f"{base}#{n}"  # repeated labels (e.g. one per table) stay distinct
+        keyed[key] = row
+    return keyed
+
+
+def diff_rows(old_rows, new_rows):
+    delta = {"added": [], "removed": [], "changed": []}
+    for key, row in new_rows.items():
+        old = old_rows.get(key)
+        if old is None: delta["added"].append({"key": key, "row": row}); continue
+        fields = {col: [old.get(col), val] for col, val in row.items() if old.get(col) != val}
+        fields.update({col: [val, None] for col, val in old.items() if col not in row})
+        if fields: delta["changed"].append({"key": key, "row": row, "fields": fields})
+    delta["removed"] = [key for key in old_rows if key not in new_rows]
+    return delta
+
+
+class ChangeSubscriber:
+    def __init__(self, url=None):
+        self.url = url
+        self.queue = asyncio.Queue(maxsize=CHANGE_STREAM_QUEUE_MAX)
+        self.lagged = False
+
+    def offer(self, event):
+        if self.url and event["url"] != self.url: return
+        try: self.queue.put_nowait(event)
+        except asyncio.QueueFull: self.lagged = True
+
+
+class ChangeTracker:
+    # Last seen table hash and rows per (url, channel, selector), plus the listeners of the delta stream.
+    def __init__(self, max_tables=CHANGE_TRACKER_MAX_TABLES):
+        self.max_tables = max_tables
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.stats = {"tables_unchanged": 0, "tables_changed": 0, "deltas_published": 0}
+
+    def previous_hashes(self, url, channel_name, selectors):
+        with self._lock:
+            return {sel: self._tables[(url, channel_name, sel)]["hash"] for sel in selectors if (url, channel_name, sel) in self._tables}
+
+    def apply(self, url, channel_name, hashes, parsed_rates):
+        # Folds one incremental parse into the stored state; returns (full rates_map, deltas by selector).
+        full_rates, deltas = {}, {}
+        with self._lock:
+            for sel, table_hash in hashes.items():
+                key = (url, channel_name, sel); state = self._tables.get(key)
+                if sel in parsed_rates:
+                    new_rows = keyed_rows(parsed_rates[sel])
+                    delta = diff_rows(state["rows"] if state else OrderedDict(), new_rows)
+                    if state is None or any(delta.values()): deltas[sel] = delta
+                    state = self._tables[key] = {"hash": table_hash, "rows": new_rows}
+                    self.stats["tables_changed"] += 1
+                elif state is not None and state["hash"] == table_hash: self.stats["tables_unchanged"] += 1
+                else: continue  # changed but not parsed (blocked page, parse error): keep the old state untouched
+                self._tables.move_to_end(key)
+                full_rates[sel] = list(state["rows"].values())
+            while len(self._tables) > self.max_tables: self._tables.popitem(last=False)
+        return full_rates, deltas
+
+    def invalidate(self, url):
+        with self._lock:
+            for key in [k for k in self._tables if k[0] == url]: del self._tables[key]
+
+    def publish(self, url, channel_name, deltas, source):
+        fetched_at = datetime.datetime.now().isoformat()
+        for sel, delta in deltas.items():
+            event = {"url": url, "channel_name": channel_name, "selector": sel, "source": source, "fetched_at": fetched_at, **delta}
+            self.stats["deltas_published"] += 1
+            for subscriber in list(self._subscribers): subscriber.offer(event)
+
+    def subscribe(self, url=None):
+        subscriber = ChangeSubscriber(url)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def snapshot(self):
+        with self._lock: tables = len(self._tables)
+        return {"tables_tracked": tables, "max_tables": self.max_tables, "subscribers": len(self._subscribers), **self.stats}
+
+
+change_tracker = ChangeTracker()
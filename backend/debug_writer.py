@@ -0,0 +1,163 @@
+from collections import deque
+import asyncio
+import datetime
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+try: import zstandard
+except ImportError: zstandard = None
+
+DEBUG_SNAPSHOTS_ENABLED = os.environ.get("SCRAPER_DEBUG_SNAPSHOTS", "1") == "1"
+DEBUG_SNAPSHOT_COMPRESSION = os.environ.get("SCRAPER_DEBUG_SNAPSHOT_COMPRESSION", "zstd" if zstandard else "gzip")  # zstd | gzip | none
+DEBUG_SNAPSHOT_DISK_BUDGET_BYTES = int(os.environ.get("SCRAPER_DEBUG_SNAPSHOT_DISK_BUDGET_BYTES", str(200 * 1024 * 1024)))
+DEBUG_SNAPSHOT_SAMPLE_EVERY = int(os.environ.get("SCRAPER_DEBUG_SNAPSHOT_SAMPLE_EVERY", "10"))  # 1 in N successful scrapes; failures always
+DEBUG_SNAPSHOT_QUEUE_MAX = int(os.environ.get("SCRAPER_DEBUG_SNAPSHOT_QUEUE_MAX", "64"))
+
+SNAPSHOT_EXTENSIONS = {"zstd": ".html.zst", "gzip": ".html.gz", "none": ".html"}
+SNAPSHOT_HASH_RE = re.compile(r'_h([0-9a-f]{16})\.html(?:\.gz|\.zst)?$')
+
+
+def compress_snapshot(data, compression):
+    if compression == "zstd" and zstandard: return zstandard.ZstdCompressor(level=10).compress(data)
+    if compression == "gzip": return gzip.compress(data, compresslevel=6)
+    return data
+
+
+# TAB (the channel's active tab id) was added later; older snapshots don't carry it.
+SNAPSHOT_HEADER_RE = re.compile(r'^<!-- DEBUG: URL:(?P<url>\S+) CH:(?P<channel_name>.*?) PGTITLE:(?P<page_title>.*?) STG:(?P<stage>.*?)'
+                                r'(?: TAB:(?P<active_tab_id>\S*))? TS:(?P<timestamp>\S+) FILE:(?P<file>\S+) -->')
+
+
+def parse_snapshot_header(html_content):
+    m = SNAPSHOT_HEADER_RE.match(html_content)
+    if not m: return None
+    header = m.groupdict(); header["active_tab_id"] = header["active_tab_id"] or None
+    return header
+
+
+def read_debug_snapshot(path):
+    with open(path, "rb") as f: data = f.read()
+    if path.endswith(".gz"): data = gzip.decompress(data)
+    elif path.endswith(".zst"):
+        if not zstandard: raise RuntimeError(f"zstandard is required to read {path}")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data.decode("utf-8", errors="replace")
+
+
+class DebugScrapeCapture:
+    # Buffers one scrape's snapshots; the writer decides at finish() whether they are kept.
+    def __init__(self, writer, url):
+        self.writer = writer
+        self.url = url
+        self.items = []
+        self.failed = False
+
+    def add(self, channel_name, html_content, page_title, stage_description="", active_tab_id=None):
+        if html_content and self.writer.enabled:
+            self.items.append((channel_name, html_content, page_title, stage_description, active_tab_id, datetime.datetime.now()))
+
+    def mark_failure(self):
+        self.failed = True
+
+    def finish(self, success=True):
+        self.writer.finish_capture(self, success and not self.failed)
+
+
+class DebugSnapshotWriter:
+    def __init__(self, save_dir, safe_name_fn, compression=DEBUG_SNAPSHOT_COMPRESSION, disk_budget_bytes=DEBUG_SNAPSHOT_DISK_BUDGET_BYTES,
+                 sample_every=DEBUG_SNAPSHOT_SAMPLE_EVERY, queue_max=DEBUG_SNAPSHOT_QUEUE_MAX, enabled=DEBUG_SNAPSHOTS_ENABLED):
+        self.save_dir = save_dir
+        self.safe_name_fn = safe_name_fn
+        self.compression = compression if compression in SNAPSHOT_EXTENSIONS and (compression != "zstd" or zstandard) else "gzip"
+        self.disk_budget_bytes = disk_budget_bytes
+        self.sample_every = max(1, sample_every)
+        self.enabled = enabled
+        self._queue = asyncio.Queue(maxsize=queue_max)
+        self._worker_task = None
+        self._success_count = 0
+        self._index_lock = threading.Lock()
+        self._hashes = set()
+        self._files = deque()  # (mtime, path, size), oldest first
+        self._total_bytes = 0
+        self.stats = {"written": 0, "deduplicated": 0, "dropped_queue_full": 0, "sampled_out": 0, "evicted": 0, "bytes_written": 0}
+        os.makedirs(save_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.save_dir):
+            path = os.path.join(self.save_dir, name)
+            try: st = os.stat(path)
+            except OSError: continue
+            entries.append((st.st_mtime, path, st.st_size))
+            m = SNAPSHOT_HASH_RE.search(name)
+            if m: self._hashes.add(m.group(1))
+        for entry in sorted(entries):
+            self._files.append(entry); self._total_bytes += entry[2]
+
+    def begin_scrape(self, url):
+        return DebugScrapeCapture(self, url)
+
+    def finish_capture(self, capture, success):
+        if not capture.items: return
+        if success:
+            self._success_count += 1
+            if self._success_count % self.sample_every != 0:
+                self.stats["sampled_out"] += len(capture.items); return
+        stage_suffix = "" if success else "_failed"
+        for channel_name, html_content, page_title, stage_description, active_tab_id, captured_at in capture.items:
+            self.submit((capture.url, channel_name, html_content, page_title, stage_description + stage_suffix, active_tab_id, captured_at))
+
+    def submit(self, item):
+        if self._worker_task is None or self._worker_task.done(): self._worker_task = asyncio.ensure_future(self._worker())
+        try: self._queue.put_nowait(item)
+        except asyncio.QueueFull: self.stats["dropped_queue_full"] += 1
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try: await asyncio.to_thread(self._write, *item)
+            except Exception as e: print(f"[DEBUG_SAVE_ERR] {item[0]} / {item[1]}: {e}")
+            finally: self._queue.task_done()
+
+    def _write(self, url, channel_name, html_content, page_title, stage_description, active_tab_id, captured_at):
+        raw = html_content.encode("utf-8", errors="replace")
+        content_hash = hashlib.sha256(raw).hexdigest()[:16]
+        with self._index_lock:
+            if content_hash in self._hashes: self.stats["deduplicated"] += 1; return
+            self._hashes.add(content_hash)
+        safe_stage_desc = self.safe_name_fn(stage_description) if stage_description else "content"
+        timestamp_str = captured_at.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        filename = f"{self.safe_name_fn(url)}_ch_{self.safe_name_fn(channel_name)}_stg_{safe_stage_desc}_{timestamp_str}_h{content_hash}{SNAPSHOT_EXTENSIONS[self.compression]}"
+        filepath = os.path.join(self.save_dir, filename)
+        header_comment = (f"<!-- DEBUG: URL:{url} CH:{channel_name} PGTITLE:{page_title} STG:{stage_description} TAB:{active_tab_id or ''} TS:{captured_at.isoformat()} FILE:{filename} -->\n\n")
+        payload = compress_snapshot(header_comment.encode("utf-8", errors="replace") + raw, self.compression)
+        with open(filepath, "wb") as f: f.write(payload)
+        with self._index_lock:
+            self._files.append((os.path.getmtime(filepath), filepath, len(payload))); self._total_bytes += len(payload)
+            self.stats["written"] += 1; self.stats["bytes_written"] += len(payload)
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        while self._files and self._total_bytes > self.disk_budget_bytes:
+            _, old_path, old_size = self._files.popleft()
+            try: os.remove(old_path)
+            except FileNotFoundError: pass
+            except OSError as e: print(f"[DEBUG_SAVE_WARN] Could not evict {old_path}: {e}"); continue
+            self._total_bytes -= old_size; self.stats["evicted"] += 1
+            m = SNAPSHOT_HASH_RE.search(os.path.basename(old_path))
+            if m: self._hashes.discard(m.group(1))
+
+    async def close(self, timeout=10):
+        if self._worker_task is None: return
+        try: await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError: print(f"[DEBUG_SAVE_WARN] {self._queue.qsize()} snapshots not written at shutdown")
+        self._worker_task.cancel()
+
+    def snapshot(self):
+        with self._index_lock:
+            return {"files": len(self._files), "disk_bytes": self._total_bytes, "disk_budget_bytes": self.disk_budget_bytes,
+                    "compression": self.compression, "sample_every": self.sample_every, "queued": self._queue.qsize(), **self.stats}
@@ -0,0 +1,442 @@
+from bs4 import BeautifulSoup, Tag
+from lxml import etree, html as lxml_html
+from lxml.cssselect import CSSSelector
+from urllib.parse import urlparse
+import functools
+import hashlib
+import os
+import re
+import time
+
+PARSER_ENGINE = os.environ.get("SCRAPER_PARSER_ENGINE", "lxml")  # "lxml" or "bs4" (legacy path)
+
+# Text under these tags is not plain NavigableString in BS4, so get_text() skips it.
+NON_TEXT_TAGS = frozenset(("script", "style", "template", "rt", "rp"))
+CELL_TAGS = frozenset(("td", "th"))
+GENERIC_TABLE_CLASSES = ('table', 'table-condensed', 'table-responsive')
+
+UNIT_SUFFIX_RE = re.compile(r'\s+(?:TL|USD|EUR|₺|%)\s*$', re.I)
+WHITESPACE_RE = re.compile(r'\s+')
+HEADER_KEY_STRIP_RE = re.compile(r'[^\w_.-]')
+PARENT_ID_RE = re.compile(r'^[a-zA-Z][\w-]*$')
+
+
+class ParsedSnapshot:
+    # One parse of a page snapshot, shared by table discovery and rate extraction.
+    __slots__ = ("html_content", "_root", "_soup", "_parse_failed")
+
+    def __init__(self, html_content):
+        self.html_content = html_content
+        self._root = None; self._soup = None; self._parse_failed = False
+
+    def __bool__(self):
+        return bool(self.html_content)
+
+    @property
+    def root(self):
+        if self._root is None and not self._parse_failed and self.html_content:
+            try: self._root = lxml_html.document_fromstring(self.html_content)
+            except ValueError:  # str input carrying an XML encoding declaration
+                try: self._root = lxml_html.document_fromstring(self.html_content.encode("utf-8"))
+                except Exception: self._parse_failed = True
+            except Exception: self._parse_failed = True
+        return self._root
+
+    @property
+    def soup(self):
+        if self._soup is None: self._soup = BeautifulSoup(self.html_content, 'html.parser')
+        return self._soup
+
+
+def as_snapshot(html_content):
+    return html_content if isinstance(html_content, ParsedSnapshot) else ParsedSnapshot(html_content)
+
+
+@functools.lru_cache(maxsize=512)
+def compiled_selector(selector_str):
+    return CSSSelector(selector_str, translator='html')
+
+
+def classes_of(el):
+    return (el.get('class') or '').split()
+
+
+def text_chunks(el):
+    chunks = []; stack = [(el, False)]
+    while stack:
+        node, tail_only = stack.pop()
+        if tail_only:
+            if node.tail: chunks.append(node.tail)
+            continue
+        if node.text and isinstance(node.tag, str) and node.tag not in NON_TEXT_TAGS: chunks.append(node.text)
+        if node.tag in NON_TEXT_TAGS: continue
+        for child in reversed(node):
+            stack.append((child, True))
+            if isinstance(child.tag, str): stack.append((child, False))
+    return chunks
+
+
+def get_text(el, separator=''):
+    return separator.join(s for s in (c.strip() for c in text_chunks(el)) if s)
+
+
+def child_elements(el, tags):
+    return [c for c in el if c.tag in tags] if isinstance(tags, frozenset) else [c for c in el if c.tag == tags]
+
+
+def first_descendant(el, tag):
+    return next(el.iterdescendants(tag), None)
+
+
+def has_descendant_cell(el):
+    return next(el.iterdescendants('td', 'th'), None) is not None
+
+
+def find_ancestor(el, predicate):
+    for ancestor in el.iterancestors():
+        if predicate(ancestor): return ancestor
+    return None
+
+
+def same_markup(a, b):
+    # BS4 compares tags structurally (name, attrs, contents), not by identity.
+    if a is b: return True
+    if a.tag != b.tag or len(a) != len(b) or (a.text or None) != (b.text or None) or dict(a.attrib) != dict(b.attrib): return False
+    for ca, cb in zip(a, b):
+        if (ca.tail or None) != (cb.tail or None) or not same_markup(ca, cb): return False
+    return True
+
+
+def find_div(root, predicate):
+    for div in root.iter('div'):
+        if predicate(div): return div
+    return None
+
+
+def parse_selectable_tags_bs4(html_content, channel_name, active_tab_id_in_html=None, current_url=None): 
+    if not html_content: return {}, []
+    soup = as_snapshot(html_content).soup
+    selectable_tags_list = []
+    processed_selectors_in_this_channel = set()
+    search_context = soup
+    
+    is_isbank = current_url and "isbank.com.tr" in urlparse(current_url).netloc
+    is_borsaistanbul = current_url and "borsaistanbul.com" in urlparse(current_url).netloc
+    is_kuveytturk = current_url and "kuveytturk.com.tr" in urlparse(current_url).netloc
+
+    if active_tab_id_in_html and not active_tab_id_in_html.startswith("isbank_content_for_"):
+        tab_pane_container = soup.find('div', id=active_tab_id_in_html, class_=lambda x: x and 'tab-pane' in x.split())
+        if tab_pane_container: search_context = tab_pane_container
+        else: active_fallback = soup.find('div', class_='tab-pane active show'); search_context = active_fallback if active_fallback else soup
+    elif is_isbank:
+        isbank_table_container = soup.find('div', class_='dk_MC')
+        if isbank_table_container: search_context = isbank_table_container
+    elif is_kuveytturk and active_tab_id_in_html: # Kuveytturk'te tab ID'si var ama محتوا در همانجا لود نمی‌شود
+         tab_pane_container_kt = soup.find('div', id=active_tab_id_in_html, class_=re.compile(r'tab-pane'))
+         if tab_pane_container_kt: search_context = tab_pane_container_kt
+         else: print(f"[PST_WARN:{channel_name}] KuveytTurk tab pane #{active_tab_id_in_html} not found, using full soup.")
+
+    potential_tables = search_context.find_all('table', recursive=True)
+    tables_to_add_final = []
+    for table_tag in potential_tables:
+        rows_in_table = table_tag.find_all('tr', recursive=False)
+        if not rows_in_table and table_tag.find('tbody'): rows_in_table = table_tag.find('tbody').find_all('tr', recursive=False)
+        if not rows_in_table or len(rows_in_table) < 1 : continue 
+        
+        first_valid_row = next((r for r in rows_in_table if r.find(['th', 'td'])), None)
+        if not first_valid_row: continue
+        cols_count = len(first_valid_row.find_all(['td', 'th'], recursive=False))
+        if cols_count < 1 : continue
+
+        relevant_table = False
+        if is_isbank: relevant_table = 'dk_MT' in (table_tag.get('class', []))
+        elif is_borsaistanbul: relevant_table = table_tag.get('id') and 'indexpage-' in table_tag.get('id')
+        elif is_kuveytturk: 
+            relevant_table = 'table-portal' in table_tag.get('class', []) and table_tag.find_parent(class_='table-responsive')
+        else: relevant_table = not table_tag.find_parent(class_=lambda x: x and 'datetimepicker' in x.split())
+        if not relevant_table: continue
+        tables_to_add_final.append(table_tag)
+
+    for table_tag in tables_to_add_final:
+        tag_id = table_tag.get('id'); classes = table_tag.get('class', [])
+        rows = table_tag.find_all('tr'); row_count = len(rows)
+        first_row = next((r for r in rows if r.find(['th', 'td'])), None)
+        cols_count = len(first_row.find_all(['td', 'th'], recursive=False)) if first_row else 0
+
+        base_sel = f"table#{tag_id}" if tag_id and not tag_id.isnumeric() else \
+                   (f"table.{'.'.join(sorted(set(c for c in classes if c and c not in ['table', 'table-condensed', 'table-responsive']))[:2])}" if \
+                    [c for c in classes if c and c not in ['table', 'table-condensed', 'table-responsive']] else "table")
+        
+        final_sel = base_sel
+        if active_tab_id_in_html and not active_tab_id_in_html.startswith(("isbank_content_for_", "generated_id_")) and not is_isbank:
+            final_sel = f"#{active_tab_id_in_html} {base_sel}"
+        elif base_sel == "table": # عمومی‌ترین حالت، سعی در دقیق‌تر کردن
+            parent_id_el = table_tag.find_parent(id=re.compile(r'^[a-zA-Z][\w-]*$')) # ID معتبر
+            if parent_id_el: final_sel = f"#{parent_id_el.get('id')} table"
+        
+        text_prev = table_tag.get_text(separator=' ', strip=True)[:50].replace('\n',' ') + "..."
+        disp_name = f"T(Sel:{final_sel[:20]}..,R:{row_count}C:{cols_count})P:{text_prev[:15]}"
+        unique_key_ch = (final_sel, row_count, cols_count, text_prev[:15])
+        if unique_key_ch in processed_selectors_in_this_channel: continue
+        processed_selectors_in_this_channel.add(unique_key_ch)
+        selectable_tags_list.append({
+            "display_name_from_parser": disp_name, "selector": final_sel, "id_attr": tag_id, 
+            "class_attr": classes, "text_preview": text_prev, "row_count": row_count, "col_count": cols_count
+        })
+    return {"channel_name": channel_name}, selectable_tags_list
+
+def parse_rates_from_html_bs4(html_content, base_url, page_title_from_playwright, channel_name, selected_selectors):
+    market_data_by_selector = {}; parsing_error_messages = []
+    if not html_content: return {}, "HTML content None."
+    soup = as_snapshot(html_content).soup
+    if "Engellendi" in page_title_from_playwright or "Blocked" in page_title_from_playwright:
+        return {}, f"Page blocked (Title: {page_title_from_playwright})."
+    if not selected_selectors: return {}, "No selectors."
+
+    for selector_str in selected_selectors:
+        elements_found = []; 
+        try: elements_found = soup.select(selector_str)
+        except Exception as e: msg = f"BS4 sel err '{selector_str}': {e}"; parsing_error_messages.append(msg); market_data_by_selector[selector_str] = []; continue
+        if not elements_found: market_data_by_selector[selector_str] = []; continue
+            
+        data_for_this_selector = []
+        for elem_idx, table_el in enumerate(elements_found): 
+            if not isinstance(table_el, Tag) or table_el.name != 'table': continue
+            
+            hdrs = []; hr_el = None; thead = table_el.find('thead'); 
+            if thead: hr_el = thead.find('tr')
+            if not hr_el:
+                cand_trs = table_el.find_all('tr', recursive=False)
+                if not cand_trs and table_el.find('tbody'): cand_trs = table_el.find('tbody').find_all('tr', recursive=False)
+                for tr in cand_trs: 
+                    if tr.find_all('th', recursive=False): hr_el = tr; break
+                if not hr_el and cand_trs and cand_trs[0].find_all(['th','td'], recursive=False): hr_el = cand_trs[0]
+
+            if not hr_el: msg = f"No header for '{selector_str}'"; parsing_error_messages.append(msg); continue
+            
+            h_cells = hr_el.find_all(['th', 'td'], recursive=False)
+            for i, cell_h in enumerate(h_cells):
+                ht = cell_h.get_text(strip=True)
+                hdrs.append(ht if ht else ("item_name" if i == 0 and len(h_cells) > 1 else f"column_{i+1}"))
+            
+            if not hdrs: msg = f"Empty headers for '{selector_str}'"; parsing_error_messages.append(msg); continue
+
+            data_rows_cont = table_el.find('tbody') or table_el
+            for data_row in data_rows_cont.find_all('tr', recursive=False):
+                if data_row == hr_el or not data_row.find_all(['td', 'th'], recursive=False): continue
+                cells = data_row.find_all(['td', 'th'], recursive=False)
+                if len(cells) < 1 : continue
+                entry = {}
+                for i_c, h_txt in enumerate(hdrs): 
+                    val = "N/A"
+                    if i_c < len(cells):
+                        raw = cells[i_c].get_text(strip=True); val = raw.replace(',', '.')
+                        val = re.sub(r'\s+(?:TL|USD|EUR|₺|%)\s*$', '', val, flags=re.I).strip()
+                        if not val and raw: val = raw
+                    clean_h = re.sub(r'\s+', '_', h_txt.lower()); clean_h = re.sub(r'[^\w_.-]', '', clean_h).strip('_.- '); 
+                    entry[clean_h if clean_h else f"col_{i_c+1}"] = val
+                if entry: data_for_this_selector.append(entry)
+            market_data_by_selector[selector_str] = data_for_this_selector
+    return market_data_by_selector, ("; ".join(parsing_error_messages) if parsing_error_messages else None)
+
+
+def parse_selectable_tags_lxml(snapshot, channel_name, active_tab_id_in_html=None, current_url=None):
+    root = snapshot.root
+    selectable_tags_list = []
+    processed_selectors_in_this_channel = set()
+    search_context = root
+
+    netloc = urlparse(current_url).netloc if current_url else ""
+    is_isbank = current_url and "isbank.com.tr" in netloc
+    is_borsaistanbul = current_url and "borsaistanbul.com" in netloc
+    is_kuveytturk = current_url and "kuveytturk.com.tr" in netloc
+
+    if active_tab_id_in_html and not active_tab_id_in_html.startswith("isbank_content_for_"):
+        tab_pane_container = find_div(root, lambda d: d.get('id') == active_tab_id_in_html and 'tab-pane' in classes_of(d))
+        if tab_pane_container is not None: search_context = tab_pane_container
+        else:
+            active_fallback = find_div(root, lambda d: classes_of(d) == ['tab-pane', 'active', 'show'])
+            search_context = active_fallback if active_fallback is not None else root
+    elif is_isbank:
+        isbank_table_container = find_div(root, lambda d: 'dk_MC' in classes_of(d))
+        if isbank_table_container is not None: search_context = isbank_table_container
+    elif is_kuveytturk and active_tab_id_in_html:
+        tab_pane_container_kt = find_div(root, lambda d: d.get('id') == active_tab_id_in_html and 'tab-pane' in ' '.join(classes_of(d)))
+        if tab_pane_container_kt is not None: search_context = tab_pane_container_kt
+        else: print(f"[PST_WARN:{channel_name}] KuveytTurk tab pane #{active_tab_id_in_html} not found, using full soup.")
+
+    tables_to_add_final = []
+    for table_tag in search_context.iterdescendants('table'):
+        rows_in_table = child_elements(table_tag, 'tr')
+        if not rows_in_table:
+            tbody = first_descendant(table_tag, 'tbody')
+            if tbody is not None: rows_in_table = child_elements(tbody, 'tr')
+        if not rows_in_table: continue
+
+        first_valid_row = next((r for r in rows_in_table if has_descendant_cell(r)), None)
+        if first_valid_row is None or not child_elements(first_valid_row, CELL_TAGS): continue
+
+        if is_isbank: relevant_table = 'dk_MT' in classes_of(table_tag)
+        elif is_borsaistanbul: relevant_table = 'indexpage-' in (table_tag.get('id') or '')
+        elif is_kuveytturk:
+            relevant_table = 'table-portal' in classes_of(table_tag) and find_ancestor(table_tag, lambda a: 'table-responsive' in classes_of(a)) is not None
+        else: relevant_table = find_ancestor(table_tag, lambda a: 'datetimepicker' in classes_of(a)) is None
+        if relevant_table: tables_to_add_final.append(table_tag)
+
+    for table_tag in tables_to_add_final:
+        tag_id = table_tag.get('id'); classes = classes_of(table_tag)
+        rows = list(table_tag.iterdescendants('tr')); row_count = len(rows)
+        first_row = next((r for r in rows if has_descendant_cell(r)), None)
+        cols_count = len(child_elements(first_row, CELL_TAGS)) if first_row is not None else 0
+
+        specific_classes = [c for c in classes if c and c not in GENERIC_TABLE_CLASSES]
+        base_sel = f"table#{tag_id}" if tag_id and not tag_id.isnumeric() else \
+                   (f"table.{'.'.join(sorted(set(specific_classes))[:2])}" if specific_classes else "table")
+
+        final_sel = base_sel
+        if active_tab_id_in_html and not active_tab_id_in_html.startswith(("isbank_content_for_", "generated_id_")) and not is_isbank:
+            final_sel = f"#{active_tab_id_in_html} {base_sel}"
+        elif base_sel == "table":
+            parent_id_el = find_ancestor(table_tag, lambda a: a.get('id') is not None and PARENT_ID_RE.search(a.get('id')))
+            if parent_id_el is not None: final_sel = f"#{parent_id_el.get('id')} table"
+
+        text_prev = get_text(table_tag, ' ')[:50].replace('\n', ' ') + "..."
+        disp_name = f"T(Sel:{final_sel[:20]}..,R:{row_count}C:{cols_count})P:{text_prev[:15]}"
+        unique_key_ch = (final_sel, row_count, cols_count, text_prev[:15])
+        if unique_key_ch in processed_selectors_in_this_channel: continue
+        processed_selectors_in_this_channel.add(unique_key_ch)
+        selectable_tags_list.append({
+            "display_name_from_parser": disp_name, "selector": final_sel, "id_attr": tag_id,
+            "class_attr": classes, "text_preview": text_prev, "row_count": row_count, "col_count": cols_count
+        })
+    return {"channel_name": channel_name}, selectable_tags_list
+
+
+def header_key(h_txt, i_c):
+    clean_h = HEADER_KEY_STRIP_RE.sub('', WHITESPACE_RE.sub('_', h_txt.lower())).strip('_.- ')
+    return clean_h if clean_h else f"col_{i_c+1}"
+
+
+def clean_cell_value(raw):
+    val = UNIT_SUFFIX_RE.sub('', raw.replace(',', '.')).strip()
+    return val if val or not raw else raw
+
+
+def extract_table_rows(table_el):
+    # Returns (rows, error) for one <table>; error is None on success.
+    hr_el = None
+    thead = first_descendant(table_el, 'thead')
+    if thead is not None: hr_el = first_descendant(thead, 'tr')
+    if hr_el is None:
+        cand_trs = child_elements(table_el, 'tr')
+        if not cand_trs:
+            tbody = first_descendant(table_el, 'tbody')
+            if tbody is not None: cand_trs = child_elements(tbody, 'tr')
+        hr_el = next((tr for tr in cand_trs if child_elements(tr, 'th')), None)
+        if hr_el is None and cand_trs and child_elements(cand_trs[0], CELL_TAGS): hr_el = cand_trs[0]
+    if hr_el is None: return None, "No header"
+
+    h_cells = child_elements(hr_el, CELL_TAGS)
+    hdrs = []
+    for i, cell_h in enumerate(h_cells):
+        ht = get_text(cell_h)
+        hdrs.append(ht if ht else ("item_name" if i == 0 and len(h_cells) > 1 else f"column_{i+1}"))
+    if not hdrs: return None, "Empty headers"
+    keys = [header_key(h_txt, i_c) for i_c, h_txt in enumerate(hdrs)]
+
+    rows = []
+    tbody = first_descendant(table_el, 'tbody')
+    data_rows_cont = tbody if tbody is not None else table_el
+    for data_row in child_elements(data_rows_cont, 'tr'):
+        cells = child_elements(data_row, CELL_TAGS)
+        if not cells or same_markup(data_row, hr_el): continue
+        cell_texts = [get_text(c) for c in cells[:len(keys)]]
+        entry = {}
+        for i_c, key in enumerate(keys): entry[key] = clean_cell_value(cell_texts[i_c]) if i_c < len(cell_texts) else "N/A"
+        if entry: rows.append(entry)
+    return rows, None
+
+
+def select_elements(snapshot, selector_str):
+    # None means cssselect can't translate it (e.g. soupsieve-only pseudo-classes); the caller then
+    # hands that selector to the BS4 path so results and error messages match.
+    try: sel = compiled_selector(selector_str)
+    except Exception: return None
+    return sel(snapshot.root)
+
+
+def parse_rates_from_html_lxml(snapshot, base_url, page_title_from_playwright, channel_name, selected_selectors):
+    market_data_by_selector = {}; parsing_error_messages = []
+    if "Engellendi" in page_title_from_playwright or "Blocked" in page_title_from_playwright:
+        return {}, f"Page blocked (Title: {page_title_from_playwright})."
+    if not selected_selectors: return {}, "No selectors."
+
+    for selector_str in selected_selectors:
+        elements_found = select_elements(snapshot, selector_str)
+        if elements_found is None:
+            bs4_rates, bs4_err = parse_rates_from_html_bs4(snapshot, base_url, page_title_from_playwright, channel_name, [selector_str])
+            market_data_by_selector.update(bs4_rates)
+            if bs4_err: parsing_error_messages.append(bs4_err)
+            continue
+        if not elements_found: market_data_by_selector[selector_str] = []; continue
+
+        data_for_this_selector = []; parsed_any = False
+        for table_el in elements_found:
+            if table_el.tag != 'table': continue
+            rows, err = extract_table_rows(table_el)
+            if err: parsing_error_messages.append(f"{err} for '{selector_str}'"); continue
+            data_for_this_selector.extend(rows); parsed_any = True
+        # Like the BS4 path, a selector whose tables all failed gets no key, so callers can tell it from an empty table.
+        if parsed_any: market_data_by_selector[selector_str] = data_for_this_selector
+    return market_data_by_selector, ("; ".join(parsing_error_messages) if parsing_error_messages else None)
+
+
+def parse_selectable_tags(html_content, channel_name, active_tab_id_in_html=None, current_url=None):
+    if not html_content: return {}, []
+    snapshot = as_snapshot(html_content)
+    if PARSER_ENGINE == "lxml" and snapshot.root is not None: return parse_selectable_tags_lxml(snapshot, channel_name, active_tab_id_in_html, current_url)
+    return parse_selectable_tags_bs4(snapshot, channel_name, active_tab_id_in_html, current_url)
+
+
+def parse_rates_from_html(html_content, base_url, page_title_from_playwright, channel_name, selected_selectors):
+    if not html_content: return {}, "HTML content None."
+    snapshot = as_snapshot(html_content)
+    if PARSER_ENGINE == "lxml" and snapshot.root is not None: return parse_rates_from_html_lxml(snapshot, base_url, page_title_from_playwright, channel_name, selected_selectors)
+    return parse_rates_from_html_bs4(snapshot, base_url, page_title_from_playwright, channel_name, selected_selectors)
+
+
+def parse_channel_snapshot(html_content, url, channel_name, page_title, active_tab_id_in_html, selected_selectors):
+    # One worker call per channel: discovery and extraction share a single parse.
+    # Also returns per-step seconds; the tree is built lazily, so its cost is counted in the first step.
+    t0 = time.perf_counter()
+    snapshot = as_snapshot(html_content)
+    _, tags_for_ch = parse_selectable_tags(snapshot, channel_name, active_tab_id_in_html=active_tab_id_in_html, current_url=url)
+    t1 = time.perf_counter(); timings = {"parse_selectable_tags": t1 - t0}
+    if not selected_selectors: return tags_for_ch, None, None, timings
+    rates_map, p_err = parse_rates_from_html(snapshot, url, page_title, channel_name, selected_selectors)
+    timings["parse_rates_from_html"] = time.perf_counter() - t1
+    return tags_for_ch, rates_map, p_err, timings
+
+
+def table_subtree_hash(snapshot, selector_str):
+    # Fingerprint of everything the selector matches; None when the selector can't be evaluated.
+    digest = hashlib.sha1()
+    elements = select_elements(snapshot, selector_str) if PARSER_ENGINE == "lxml" and snapshot.root is not None else None
+    if elements is not None:
+        for el in elements: digest.update(etree.tostring(el, encoding="utf-8", with_tail=False))
+    else:
+        try: soup_elements = snapshot.soup.select(selector_str)
+        except Exception: return None
+        for el in soup_elements: digest.update(str(el).encode("utf-8", errors="replace"))
+    return digest.hexdigest()[:16]
+
+
+def parse_rates_incremental(html_content, base_url, page_title, channel_name, selected_selectors, previous_hashes):
+    # Re-parses only the selectors whose table subtree changed; returns (hashes, rates_map of those, p_err).
+    if not html_content: return {}, {}, "HTML content None."
+    snapshot = as_snapshot(html_content)
+    hashes = {sel: table_subtree_hash(snapshot, sel) for sel in selected_selectors}
+    changed = [sel for sel in selected_selectors if hashes[sel] is None or hashes[sel] != previous_hashes.get(sel)]
+    if not changed: return hashes, {}, None
+    rates_map, p_err = parse_rates_from_html(snapshot, base_url, page_title, channel_name, changed)
+    return hashes, rates_map, p_err
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import os
+import re
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+METRICS_ENABLED = os.environ.get("SCRAPER_METRICS", "1") == "1"
+STAGE_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 90)
+
+# Status codes and page markers of bot walls / WAF interstitials served instead of the real page.
+BLOCKED_STATUS_CODES = frozenset((403, 429, 503))
+BLOCKED_PAGE_MARKERS = (
+    ("captcha", re.compile(r'g-recaptcha|h-captcha|hcaptcha\.com|px-captcha|captcha-delivery\.com|distil_r_captcha', re.I)),
+    ("cloudflare", re.compile(r'cf-chl-|cf_chl_opt|<title>\s*(?:Just a moment|Attention Required)', re.I)),
+    ("incapsula", re.compile(r'_Incapsula_Resource|Incapsula incident', re.I)),
+    ("access_denied", re.compile(r'<title>\s*(?:Access Denied|Erişim Engellendi|Request Rejected|403 Forbidden)', re.I)),
+)
+# Titles the rate parser rejects as "Page blocked" (html_engine.parse_rates_from_html).
+BLOCKED_TITLE_MARKERS = ("Engellendi", "Blocked")
+
+registry = CollectorRegistry(auto_describe=True)
+stage_seconds = Histogram("scraper_stage_seconds", "Duration of scrape, parse and render stages", ["domain", "stage"], buckets=STAGE_BUCKETS_S, registry=registry)
+scrapes_total = Counter("scraper_scrapes_total", "Scrapes by outcome", ["domain", "outcome"], registry=registry)
+blocked_pages_total = Counter("scraper_blocked_pages_total", "Pages detected as bot walls or access-denied responses", ["domain", "reason"], registry=registry)
+interaction_failures_total = Counter("scraper_interaction_failures_total", "Channel interactions that raised", ["domain"], registry=registry)
+render_requests_total = Counter("scraper_render_requests_total", "/render requests by HTTP status", ["domain", "status"], registry=registry)
+
+
+def domain_of(url):
+    return urlparse(url or "").netloc or "unknown"
+
+
+def detect_blocked_page(status, html_content):
+    if status in BLOCKED_STATUS_CODES: return f"http_{status}"
+    head = (html_content or "")[:20000]
+    for reason, pattern in BLOCKED_PAGE_MARKERS:
+        if pattern.search(head): return reason
+    return None
+
+
+def is_blocked_title(page_title):
+    return any(marker in (page_title or "") for marker in BLOCKED_TITLE_MARKERS)
+
+
+class StageTimer:
+    # Per-request timing breakdown; every stage also lands in the per-domain histogram.
+    def __init__(self, url):
+        self.domain = domain_of(url)
+        self.records = []
+
+    def observe(self, stage, seconds, channel=None, keep=True):
+        if METRICS_ENABLED: stage_seconds.labels(self.domain, stage).observe(seconds)
+        if keep:
+            rec = {"stage": stage, "elapsed_ms": round(seconds * 1000, 1)}
+            if channel is not None: rec["channel"] = channel
+            self.records.append(rec)
+
+    @contextmanager
+    def stage(self, name, channel=None):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - t0, channel)
+
+    def observe_waits(self, wait_recorder):
+        # Wait steps are already itemised per channel in wait_timings; only the histogram needs them.
+        for rec in wait_recorder.records:
+            if rec["condition"] == "total": self.observe(f"wait_{rec['stage']}", rec["elapsed_ms"] / 1000, keep=False)
+
+    def breakdown(self):
+        totals = {}
+        for rec in self.records: totals[rec["stage"]] = round(totals.get(rec["stage"], 0.0) + rec["elapsed_ms"], 1)
+        return {"domain": self.domain, "totals_ms": totals, "stages": list(self.records)}
+
+
+def count_scrape(url, outcome):
+    if METRICS_ENABLED: scrapes_total.labels(domain_of(url), outcome).inc()
+
+
+def count_blocked_page(url, reason):
+    if METRICS_ENABLED: blocked_pages_total.labels(domain_of(url), reason).inc()
+
+
+def count_interaction_failure(url):
+    if METRICS_ENABLED: interaction_failures_total.labels(domain_of(url)).inc()
+
+
+def count_render_request(url, status):
+    if METRICS_ENABLED: render_requests_total.labels(domain_of(url), str(status)).inc()
+
+
+def metrics_exposition():
+    return generate_latest(registry), CONTENT_TYPE_LATEST
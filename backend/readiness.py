@@ -0,0 +1,136 @@
+from urllib.parse import urlparse
+import asyncio
+import threading
+import time
+
+# Upper bounds (ms) for each wait stage. They are the old fixed sleeps; a stage
+# normally returns as soon as its readiness condition holds.
+WAIT_DEADLINES_MS = {
+    "initial_load": 8000, "scroll": 2500, "scroll_top": 1500,
+    "select_option": 2000, "view_button": 6000, "tab_click": 5000,
+}
+SITE_WAIT_DEADLINES_MS = {
+    "isbank.com.tr": {"view_button": 8000},
+    "kuveytturk.com.tr": {"initial_load": 10000},
+}
+DOM_QUIET_MS = 400
+POLL_INTERVAL_MS = 100
+
+TABLE_SIGNATURE_JS = """(sel) => {
+    const els = document.querySelectorAll(sel); let h = 0, n = 0;
+    for (const el of els) { const t = el.textContent || ''; n += t.length;
+        for (let i = 0; i < t.length; i++) h = (h * 31 + t.charCodeAt(i)) | 0; }
+    return els.length + ':' + n + ':' + h;
+}"""
+TABLE_CHANGED_JS = "([sel, prev]) => { const els = document.querySelectorAll(sel); if (!els.length) return false; " \
+                   "return (" + TABLE_SIGNATURE_JS + ")(sel) !== prev; }"
+DOM_SETTLE_JS = """([quietMs, maxMs]) => new Promise(resolve => {
+    let quiet = null, cap = null;
+    const obs = new MutationObserver(() => { clearTimeout(quiet); quiet = setTimeout(() => done(true), quietMs); });
+    const done = (settled) => { obs.disconnect(); clearTimeout(quiet); clearTimeout(cap); resolve(settled); };
+    obs.observe(document.documentElement, {subtree: true, childList: true, attributes: true, characterData: true});
+    quiet = setTimeout(() => done(true), quietMs); cap = setTimeout(() => done(false), maxMs);
+})"""
+
+_wait_stats = {}
+_wait_stats_lock = threading.Lock()
+
+
+class WaitRecorder:
+    def __init__(self, url):
+        self.domain = urlparse(url).netloc or "unknown"
+        self.records = []
+
+    def deadline_ms(self, stage):
+        for site, overrides in SITE_WAIT_DEADLINES_MS.items():
+            if site in self.domain and stage in overrides: return overrides[stage]
+        return WAIT_DEADLINES_MS.get(stage, 5000)
+
+    def record(self, stage, condition, elapsed_ms, reached, deadline_ms):
+        rec = {"stage": stage, "condition": condition, "elapsed_ms": round(elapsed_ms, 1), "reached": reached, "deadline_ms": deadline_ms}
+        self.records.append(rec)
+        with _wait_stats_lock:
+            agg = _wait_stats.setdefault(self.domain, {}).setdefault(f"{stage}:{condition}", {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "timeouts": 0})
+            agg["count"] += 1; agg["total_ms"] += elapsed_ms; agg["max_ms"] = max(agg["max_ms"], elapsed_ms)
+            if not reached: agg["timeouts"] += 1
+        return rec
+
+    def mark(self):
+        return len(self.records)
+
+    def since(self, mark):
+        return self.records[mark:]
+
+    def total_ms(self, records=None):
+        return round(sum(r["elapsed_ms"] for r in (self.records if records is None else records) if r["condition"] == "total"), 1)
+
+
+def wait_stats_snapshot():
+    with _wait_stats_lock:
+        return {dom: {k: {**v, "avg_ms": round(v["total_ms"] / v["count"], 1) if v["count"] else 0.0} for k, v in stages.items()}
+                for dom, stages in _wait_stats.items()}
+
+
+async def table_signature(page, selector):
+    try: return await page.evaluate(TABLE_SIGNATURE_JS, selector)
+    except Exception: return None
+
+
+async def wait_for_network_idle(page, timeout_ms):
+    try: await page.wait_for_load_state("networkidle", timeout=timeout_ms); return True
+    except Exception: return False
+
+
+async def wait_for_table_present(page, selector, timeout_ms):
+    try: await page.wait_for_selector(selector, state="attached", timeout=timeout_ms); return True
+    except Exception: return False
+
+
+async def wait_for_table_change(page, selector, previous_signature, timeout_ms):
+    try: await page.wait_for_function(TABLE_CHANGED_JS, arg=[selector, previous_signature], timeout=timeout_ms, polling=POLL_INTERVAL_MS); return True
+    except Exception: return False
+
+
+async def wait_for_dom_settle(page, quiet_ms, timeout_ms):
+    if timeout_ms <= 0: return False
+    try: return bool(await page.evaluate(DOM_SETTLE_JS, [quiet_ms, timeout_ms]))
+    except Exception: return False
+
+
+async def first_ready(*coros):
+    # True as soon as any condition holds (the rest are cancelled); False once all have given up.
+    pending = {asyncio.ensure_future(c) for c in coros}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(not t.cancelled() and t.exception() is None and t.result() for t in done): return True
+        return False
+    finally:
+        for t in pending: t.cancel()
+
+
+async def wait_until_ready(page, recorder, stage, table_selector=None, previous_signature=None, network_idle=False, quiet_ms=DOM_QUIET_MS):
+    deadline_ms = recorder.deadline_ms(stage)
+    started = time.perf_counter()
+    remaining = lambda: max(0, int(deadline_ms - (time.perf_counter() - started) * 1000))
+
+    async def step(condition, coro_factory):
+        t0 = time.perf_counter(); budget = remaining()
+        # Playwright treats timeout=0 as "wait forever", so an exhausted budget must short-circuit.
+        ok = await coro_factory(budget) if budget > 0 else False
+        recorder.record(stage, condition, (time.perf_counter() - t0) * 1000, ok, deadline_ms)
+        return ok
+
+    async def content_ready():
+        ready = True
+        if table_selector and previous_signature is not None:
+            ready = await step("table_change", lambda t: wait_for_table_change(page, table_selector, previous_signature, t)) and ready
+        elif table_selector:
+            ready = await step("table_present", lambda t: wait_for_table_present(page, table_selector, t)) and ready
+        return await step("dom_settle", lambda t: wait_for_dom_settle(page, min(quiet_ms, t), t)) and ready
+
+    # Network idle races the table checks: pages with analytics or long polling may never go idle.
+    if network_idle: ready = await first_ready(step("network_idle", lambda t: wait_for_network_idle(page, t)), content_ready())
+    else: ready = await content_ready()
+    recorder.record(stage, "total", (time.perf_counter() - started) * 1000, ready, deadline_ms)
+    return ready
@@ -0,0 +1,89 @@
+from urllib.parse import urlparse
+import json
+import os
+
+RESOURCE_BLOCKING_ENABLED = os.environ.get("SCRAPER_RESOURCE_BLOCKING", "1") == "1"
+
+# Stylesheets stay allowed: tab discovery relies on is_visible(), which needs the page's CSS.
+BLOCKED_RESOURCE_TYPES = frozenset(("image", "media", "font"))
+BLOCKED_URL_PATTERNS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com", "googleadservices.com",
+    "connect.facebook.net", "facebook.com/tr", "hotjar.com", "mc.yandex.ru", "clarity.ms", "bat.bing.com", "snap.licdn.com",
+    "analytics.tiktok.com", "criteo.com", "criteo.net", "adform.net", "useinsider.com", "segment.com", "js-agent.newrelic.com",
+    "static.ads-twitter.com", "adjust.com", "appsflyer.com",
+)
+# Per-domain overrides, matched by substring of the page's host like the parsers' site checks. Keys:
+#   "disabled": True                      -> no interception for that site
+#   "allow_resource_types": ["font"]      -> resource types to let through
+#   "allow_url_patterns": ["cdn.x.com"]   -> URL substrings to let through (wins over blocking)
+#   "block_url_patterns": ["chat.x.com"]  -> extra URL substrings to block
+# Extra entries can be supplied as JSON in SCRAPER_RESOURCE_OVERRIDES.
+DOMAIN_RESOURCE_OVERRIDES = {}
+DOMAIN_RESOURCE_OVERRIDES.update(json.loads(os.environ.get("SCRAPER_RESOURCE_OVERRIDES", "{}") or "{}"))
+
+# Blocked requests never download, so "bytes saved" is estimated from typical sizes per type.
+TYPICAL_RESOURCE_BYTES = {"image": 35_000, "media": 400_000, "font": 45_000, "script": 40_000, "stylesheet": 25_000, "xhr": 8_000, "fetch": 8_000}
+DEFAULT_RESOURCE_BYTES = 10_000
+
+
+class ResourceStats:
+    def __init__(self):
+        self.requests_total = 0
+        self.requests_blocked = 0
+        self.blocked_by_reason = {}
+        self.bytes_loaded = 0
+        self.estimated_bytes_saved = 0
+
+    def as_dict(self):
+        return {"requests_total": self.requests_total, "requests_blocked": self.requests_blocked,
+                "requests_allowed": self.requests_total - self.requests_blocked, "blocked_by_reason": dict(self.blocked_by_reason),
+                "bytes_loaded": self.bytes_loaded, "estimated_bytes_saved": self.estimated_bytes_saved}
+
+
+class ResourceProfile:
+    def __init__(self, url, enabled=RESOURCE_BLOCKING_ENABLED):
+        host = urlparse(url).netloc
+        overrides = {}
+        for site, site_overrides in DOMAIN_RESOURCE_OVERRIDES.items():
+            if site in host: overrides = site_overrides; break
+        self.enabled = enabled and not overrides.get("disabled")
+        self.blocked_types = BLOCKED_RESOURCE_TYPES - set(overrides.get("allow_resource_types", []))
+        self.blocked_patterns = BLOCKED_URL_PATTERNS + tuple(overrides.get("block_url_patterns", []))
+        self.allowed_patterns = tuple(overrides.get("allow_url_patterns", []))
+
+    def block_reason(self, request_url, resource_type):
+        if not self.enabled or request_url.startswith(("data:", "blob:")): return None
+        if any(p in request_url for p in self.allowed_patterns): return None
+        if resource_type in self.blocked_types: return f"type:{resource_type}"
+        for pattern in self.blocked_patterns:
+            if pattern in request_url: return f"pattern:{pattern}"
+        return None
+
+
+async def apply_resource_profile(page, url, stats, enabled=RESOURCE_BLOCKING_ENABLED):
+    profile = ResourceProfile(url, enabled=enabled)
+
+    async def handle_route(route):
+        req = route.request
+        reason = profile.block_reason(req.url, req.resource_type)
+        if reason:
+            stats.requests_blocked += 1
+            stats.blocked_by_reason[reason] = stats.blocked_by_reason.get(reason, 0) + 1
+            stats.estimated_bytes_saved += TYPICAL_RESOURCE_BYTES.get(req.resource_type, DEFAULT_RESOURCE_BYTES)
+            try: await route.abort("blockedbyclient")
+            except Exception: pass
+            return
+        try: await route.continue_()
+        except Exception: pass
+
+    def on_request(request):
+        stats.requests_total += 1
+
+    def on_response(response):
+        try: stats.bytes_loaded += int(response.headers.get("content-length") or 0)
+        except (TypeError, ValueError): pass
+
+    page.on("request", on_request)
+    page.on("response", on_response)
+    if profile.enabled: await page.route("**/*", handle_route)
+    return profile
@@ -0,0 +1,210 @@
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+import asyncio
+import datetime
+import glob
+import json
+import math
+import os
+import random
+import threading
+import time
+import traceback
+
+SCHEDULER_ENABLED = os.environ.get("SCRAPER_SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_DEFAULT_INTERVAL_S = float(os.environ.get("SCRAPER_SCHEDULER_DEFAULT_INTERVAL_S", "900"))
+SCHEDULER_MIN_INTERVAL_S = 60.0
+SCHEDULER_JITTER_FRACTION = float(os.environ.get("SCRAPER_SCHEDULER_JITTER_FRACTION", "0.1"))
+SCHEDULER_TICK_S = float(os.environ.get("SCRAPER_SCHEDULER_TICK_S", "15"))
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("SCRAPER_SCHEDULER_MAX_CONCURRENCY", "2"))
+SCHEDULER_DOMAIN_MIN_GAP_S = float(os.environ.get("SCRAPER_SCHEDULER_DOMAIN_MIN_GAP_S", "30"))
+DOMAIN_CONCURRENCY = int(os.environ.get("SCRAPER_DOMAIN_CONCURRENCY", "1"))
+
+RATES_STORE_DIR = "rates_store"
+
+
+def selectors_by_channel_from_config(config):
+    saved = config.get("saved_market_data_by_channel") or {}
+    return {ch_name: [sel for sel in ch_rates.keys() if sel] for ch_name, ch_rates in saved.items() if isinstance(ch_rates, dict) and ch_rates}
+
+
+def parse_poll_interval(value):
+    # None/"" means the default interval; anything else must be a positive finite number of seconds.
+    if value is None or value == "": return None
+    if isinstance(value, bool): raise ValueError(f"Invalid poll_interval_s: {value!r}")
+    interval_s = float(value)
+    if not math.isfinite(interval_s) or interval_s <= 0: raise ValueError(f"Invalid poll_interval_s: {value!r}")
+    return interval_s
+
+
+def jittered(interval_s, fraction=SCHEDULER_JITTER_FRACTION):
+    return max(1.0, interval_s * (1 + random.uniform(-fraction, fraction)))
+
+
+class RatesStore:
+    def __init__(self, store_dir=RATES_STORE_DIR):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._latest = {}
+        self._lock = threading.Lock()
+        for path in glob.glob(os.path.join(store_dir, "*_latest.json")):
+            try:
+                with open(path, encoding="utf-8") as f: record = json.load(f)
+                if record.get("url"): self._latest[record["url"]] = record
+            except Exception as e: print(f"[STORE_WARN] Unreadable rates file {path}: {e}")
+
+    def put(self, safe_name, record):
+        with self._lock: self._latest[record["url"]] = record
+        path = os.path.join(self.store_dir, f"{safe_name}_latest.json")
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(record, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as e: print(f"[STORE_ERR] {path}: {e}")
+
+    def get(self, url):
+        with self._lock: return self._latest.get(url)
+
+    def all(self):
+        with self._lock: return dict(self._latest)
+
+
+class DomainRateLimiter:
+    # Per-domain concurrency cap and start-to-start gap. Callers may ask for their own gap, measured from the last start by anyone.
+    def __init__(self, min_gap_s=SCHEDULER_DOMAIN_MIN_GAP_S, concurrency=DOMAIN_CONCURRENCY):
+        self.min_gap_s = min_gap_s
+        self.concurrency = max(1, concurrency)
+        self._last_start = {}
+        self._locks = {}
+        self._semaphores = {}
+
+    async def acquire(self, url, min_gap_s=None):
+        domain = urlparse(url).netloc
+        gap_s = self.min_gap_s if min_gap_s is None else min_gap_s
+        lock = self._locks.setdefault(domain, asyncio.Lock())
+        async with lock:
+            wait_s = self._last_start.get(domain, -gap_s) + gap_s - time.monotonic()
+            if wait_s > 0: await asyncio.sleep(wait_s)
+            self._last_start[domain] = time.monotonic()
+
+    @asynccontextmanager
+    async def slot(self, url, min_gap_s=None):
+        async with self._semaphores.setdefault(urlparse(url).netloc, asyncio.Semaphore(self.concurrency)):
+            await self.acquire(url, min_gap_s)
+            yield
+
+
+# One registry for every path that scrapes on its own schedule (scheduler polls, batch renders), so they never stack up on a bank.
+shared_domain_limiter = DomainRateLimiter()
+
+
+class RatesScheduler:
+    # scrape_fn(url) -> channel data list; parse_fn is an async wrapper around parse_rates_from_html.
+    def __init__(self, scrape_fn, parse_fn, config_dir, store, safe_name_fn,
+                 max_concurrency=SCHEDULER_MAX_CONCURRENCY, domain_limiter=None, tick_s=SCHEDULER_TICK_S):
+        self.scrape_fn = scrape_fn
+        self.parse_fn = parse_fn
+        self.config_dir = config_dir
+        self.store = store
+        self.safe_name_fn = safe_name_fn
+        self.max_concurrency = max_concurrency
+        self.domain_limiter = domain_limiter or shared_domain_limiter
+        self.tick_s = tick_s
+        self._jobs = {}  # config path -> job dict
+        self._skipped = {}  # config path -> mtime of a version that couldn't be used
+        self._semaphore = None
+        self._running = set()
+        self._main_task = None
+
+    def _read_configs(self, known_mtimes):
+        # Worker-thread half of a reload: globbing and file reads only, the job table is updated on the loop.
+        found = {}
+        for path in glob.glob(os.path.join(self.config_dir, "*_rates_config.json")):
+            try: mtime = os.path.getmtime(path)
+            except OSError: continue
+            if known_mtimes.get(path) == mtime: found[path] = (mtime, None); continue
+            try:
+                with open(path, encoding="utf-8") as f: config = json.load(f)
+                interval_s = max(SCHEDULER_MIN_INTERVAL_S, parse_poll_interval(config.get("poll_interval_s")) or SCHEDULER_DEFAULT_INTERVAL_S)
+                found[path] = (mtime, (config.get("url"), selectors_by_channel_from_config(config), interval_s))
+            except Exception as e: found[path] = (mtime, e)
+        return found
+
+    async def _load_configs(self):
+        known_mtimes = {path: job["mtime"] for path, job in self._jobs.items()}; known_mtimes.update(self._skipped)
+        found = await asyncio.to_thread(self._read_configs, known_mtimes)
+        for path, (mtime, loaded) in found.items():
+            if loaded is None: continue
+            if isinstance(loaded, Exception): print(f"[SCHED_WARN] Unusable config {path}: {loaded}"); self._skipped[path] = mtime; continue
+            self._skipped.pop(path, None)
+            url, selectors_by_channel, interval_s = loaded
+            if not url or not selectors_by_channel: continue
+            job = self._jobs.get(path)
+            # New configs start after a random slice of their interval so a restart doesn't stampede every site.
+            if not job: job = self._jobs[path] = {"next_run": time.monotonic() + random.uniform(0, min(interval_s, self.tick_s * 4)), "in_flight": False}
+            job.update({"url": url, "selectors_by_channel": selectors_by_channel, "interval_s": interval_s, "mtime": mtime})
+        for path in list(self._jobs):
+            if path not in found: del self._jobs[path]
+        for path in list(self._skipped):
+            if path not in found: del self._skipped[path]
+
+    async def poll_job(self, job):
+        try: await self._poll(job)
+        finally: job["in_flight"] = False
+
+    async def _poll(self, job):
+        url = job["url"]
+        # Domain cap and gap before a slot, so polls queued behind one bank don't idle every slot.
+        async with self.domain_limiter.slot(url), self._semaphore:
+            started = time.monotonic()
+            record = {"url": url, "fetched_at": datetime.datetime.now().isoformat(), "channels_data_parsed": {}, "channel_errors": {}, "status": "ok"}
+            try:
+                channel_html_data = await self.scrape_fn(url)
+                if not channel_html_data: record["status"] = "error"; record["error"] = "No content/channels."
+                for ch_data in channel_html_data or []:
+                    ch_name = ch_data.get("channel_name", "Unknown"); ch_selectors = job["selectors_by_channel"].get(ch_name)
+                    if not ch_selectors: continue
+                    rates_map, p_err = await self.parse_fn(ch_data.get("html_content"), url, ch_data.get("page_title", "N/A"), ch_name, ch_selectors)
+                    if rates_map: record["channels_data_parsed"][ch_name] = rates_map
+                    if p_err: record["channel_errors"][ch_name] = p_err
+                missing = [ch for ch in job["selectors_by_channel"] if ch not in record["channels_data_parsed"]]
+                if missing and record["status"] == "ok": record["status"] = "partial"; record["missing_channels"] = missing
+            except Exception as e:
+                record["status"] = "error"; record["error"] = str(e); traceback.print_exc()
+            record["duration_s"] = round(time.monotonic() - started, 2)
+            previous = self.store.get(url)
+            # Keep the last good rates visible when a poll fails outright.
+            if record["status"] == "error" and previous and previous.get("channels_data_parsed"):
+                record["channels_data_parsed"] = previous["channels_data_parsed"]; record["stale_since"] = previous.get("stale_since") or previous.get("fetched_at")
+            await asyncio.to_thread(self.store.put, self.safe_name_fn(url), record)
+            print(f"[SCHED] {url}: {record['status']} in {record['duration_s']}s")
+
+    def _launch(self, job):
+        job["in_flight"] = True
+        job["next_run"] = time.monotonic() + jittered(job["interval_s"])
+        task = asyncio.ensure_future(self.poll_job(job))
+        self._running.add(task); task.add_done_callback(self._running.discard)
+
+    async def run(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        print(f"[SCHED] Started (config dir: {self.config_dir})")
+        while True:
+            try:
+                await self._load_configs()
+                now = time.monotonic()
+                for job in self._jobs.values():
+                    if job["next_run"] <= now and not job["in_flight"]: self._launch(job)
+            except Exception as e: print(f"[SCHED_ERR] Tick failed: {e}")
+            await asyncio.sleep(self.tick_s)
+
+    def start(self):
+        if self._main_task is None or self._main_task.done(): self._main_task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._main_task: self._main_task.cancel()
+        for task in list(self._running): task.cancel()
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [{"url": job["url"], "interval_s": job["interval_s"], "next_run_in_s": round(job["next_run"] - now, 1), "in_flight": job["in_flight"]}
+                for job in self._jobs.values()]
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+SNAPSHOT_CACHE_TTL_S = float(os.environ.get("SCRAPER_SNAPSHOT_CACHE_TTL_S", "300"))
+SNAPSHOT_CACHE_MAX_ENTRIES = int(os.environ.get("SCRAPER_SNAPSHOT_CACHE_MAX_ENTRIES", "256"))
+SNAPSHOT_CACHE_MAX_BYTES = int(os.environ.get("SCRAPER_SNAPSHOT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class SnapshotCache:
+    def __init__(self, ttl_s=SNAPSHOT_CACHE_TTL_S, max_entries=SNAPSHOT_CACHE_MAX_ENTRIES, max_bytes=SNAPSHOT_CACHE_MAX_BYTES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # url -> (stored_at, size_bytes, channel data list in scrape order)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def _entry_size(channel_data_list):
+        return sum(len((ch.get("html_content") or "").encode("utf-8", errors="ignore")) for ch in channel_data_list)
+
+    def _drop(self, url):
+        _, size, _ = self._entries.pop(url)
+        self._bytes -= size
+
+    def get_channels(self, url):
+        # One entry per page: channels sharing a name stay distinct and are never served partially.
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry and time.monotonic() - entry[0] > self.ttl_s:
+                self._drop(url); self.stats["expired"] += 1; entry = None
+            if not entry:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(url); self.stats["hits"] += 1
+            return list(entry[2])
+
+    def put_channels(self, url, channel_data_list):
+        if not channel_data_list: return
+        size = self._entry_size(channel_data_list)
+        with self._lock:
+            if url in self._entries: self._drop(url)
+            if size > self.max_bytes: return
+            self._entries[url] = (time.monotonic(), size, list(channel_data_list)); self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest_url = next(iter(self._entries))
+                self._drop(oldest_url); self.stats["evictions"] += 1
+
+    def invalidate(self, url):
+        with self._lock:
+            if url in self._entries: self._drop(url)
+
+    def snapshot(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "ttl_s": self.ttl_s, "max_entries": self.max_entries, "max_bytes": self.max_bytes, **self.stats}
+
+
+snapshot_cache = SnapshotCache()
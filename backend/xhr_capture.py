@@ -0,0 +1,236 @@
+from urllib.parse import urlparse
+import asyncio
+import datetime
+import html
+import json
+import os
+import threading
+
+import httpx
+
+from html_engine import parse_selectable_tags, parse_rates_from_html
+
+XHR_CAPTURE_DEFAULT = os.environ.get("SCRAPER_XHR_CAPTURE", "0") == "1"
+XHR_RECIPE_DIR = "xhr_recipes"
+XHR_MAX_BODY_BYTES = 2 * 1024 * 1024
+XHR_HTTP_TIMEOUT_S = float(os.environ.get("SCRAPER_XHR_HTTP_TIMEOUT_S", "20"))
+XHR_HTTP_MAX_CONNECTIONS = int(os.environ.get("SCRAPER_XHR_HTTP_MAX_CONNECTIONS", "20"))
+
+# Headers replayed from the recorded request. Cookies are deliberately not stored; endpoints that
+# need the browser session fail the shape check and fall back to the browser path.
+REPLAY_HEADERS = frozenset(("accept", "accept-language", "content-type", "origin", "referer", "user-agent", "x-requested-with"))
+
+
+class XhrReplayError(Exception):
+    pass
+
+
+def find_html_in_json(data, path=()):
+    if isinstance(data, str): return (list(path), data) if "<table" in data.lower() else None
+    items = data.items() if isinstance(data, dict) else enumerate(data) if isinstance(data, list) else ()
+    for key, value in items:
+        found = find_html_in_json(value, path + (key,))
+        if found: return found
+    return None
+
+
+def follow_json_path(data, path):
+    for key in path: data = data[key]
+    if not isinstance(data, str): raise TypeError("JSON path no longer points to a string")
+    return data
+
+
+def extract_table_fragment(body, content_type):
+    # Returns (body_kind, json_path, html_fragment) or None when the response carries no table markup.
+    if "json" in (content_type or "") or body.lstrip()[:1] in ("{", "["):
+        try: data = json.loads(body)
+        except ValueError: data = None
+        if data is not None:
+            found = find_html_in_json(data)
+            return ("json", found[0], found[1]) if found else None
+    if "<table" in body.lower(): return ("html", None, body)
+    return None
+
+
+def wrap_fragment(fragment, active_tab_id_in_html):
+    # Tab selectors are scoped as "#<pane> table", so the bare fragment gets its pane back.
+    if active_tab_id_in_html: fragment = f'<div id="{html.escape(active_tab_id_in_html, quote=True)}" class="tab-pane active show">{fragment}</div>'
+    return f"<html><body>{fragment}</body></html>"
+
+
+def table_profile(page_html, url, page_title, channel_name, selectors):
+    # Row count and column names per selector, from the same extraction /render runs.
+    rates_map, _ = parse_rates_from_html(page_html, url, page_title, channel_name, selectors)
+    return {sel: {"rows": len(rows), "columns": sorted({col for row in rows for col in row})} for sel, rows in rates_map.items()}
+
+
+def dom_profile(ch_data, url):
+    _, tags = parse_selectable_tags(ch_data["html_content"], ch_data["channel_name"], active_tab_id_in_html=ch_data.get("active_tab_id_in_html"), current_url=url)
+    profile = table_profile(ch_data["html_content"], url, ch_data.get("page_title", "N/A"), ch_data["channel_name"], [t["selector"] for t in tags])
+    return {sel: p for sel, p in profile.items() if p["rows"]}
+
+
+def match_fragment(ch_data, url, fragments):
+    # Parse-worker job: the channel's DOM table profile and the index of the last fragment reproducing it.
+    # The last one wins: it's the response the page rendered after the interaction settled.
+    expected_profile = dom_profile(ch_data, url)
+    if not expected_profile: return None, None
+    for idx in reversed(range(len(fragments))):
+        page_html = wrap_fragment(fragments[idx], ch_data.get("active_tab_id_in_html"))
+        if table_profile(page_html, url, ch_data.get("page_title", "N/A"), ch_data["channel_name"], list(expected_profile)) == expected_profile: return expected_profile, idx
+    return expected_profile, None
+
+
+class PageResponseRecorder:
+    def __init__(self, page):
+        self.responses = []
+        self._pending = set()
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        if response.request.resource_type not in ("xhr", "fetch"): return
+        task = asyncio.ensure_future(self._record(response))
+        self._pending.add(task); task.add_done_callback(self._pending.discard)
+
+    async def _record(self, response):
+        try:
+            if not response.ok: return
+            headers = await response.all_headers()
+            if int(headers.get("content-length") or 0) > XHR_MAX_BODY_BYTES: return
+            content_type = headers.get("content-type", "")
+            if not any(kind in content_type for kind in ("json", "html", "text")): return
+            body = await response.text()
+            if len(body) > XHR_MAX_BODY_BYTES: return
+            req = response.request
+            req_headers = {k: v for k, v in (await req.all_headers()).items() if k.lower() in REPLAY_HEADERS}
+            self.responses.append({"url": req.url, "method": req.method, "headers": req_headers, "post_data": req.post_data,
+                                   "content_type": content_type, "body": body})
+        except Exception as e: print(f"[XHR_WARN] Could not record {response.url}: {e}")
+
+    def mark(self):
+        return len(self.responses)
+
+    async def since(self, mark):
+        if self._pending: await asyncio.gather(*list(self._pending), return_exceptions=True)
+        return self.responses[mark:]
+
+
+class XhrCapture:
+    # Per-scrape recording: which XHR responses each channel interaction produced.
+    def __init__(self, url):
+        self.url = url
+        self.channel_responses = {}
+        self._recorders = {}
+
+    def attach(self, page):
+        self._recorders[id(page)] = PageResponseRecorder(page)
+
+    def begin_channel(self, page):
+        recorder = self._recorders.get(id(page))
+        return recorder.mark() if recorder else None
+
+    async def end_channel(self, page, channel_name, mark):
+        recorder = self._recorders.get(id(page))
+        if recorder and mark is not None: self.channel_responses[channel_name] = await recorder.since(mark)
+
+    async def build_recipe(self, channel_results, run_job):
+        # run_job(fn, *args) runs the CPU-bound table profiling off the serving process (app.run_parse_job).
+        recipe_channels = []
+        for ch_data in channel_results:
+            ch_name = ch_data["channel_name"]; active_tab_id = ch_data.get("active_tab_id_in_html"); page_title = ch_data.get("page_title", "N/A")
+            candidates = [(resp, fragment) for resp in self.channel_responses.get(ch_name, [])
+                          for fragment in [extract_table_fragment(resp["body"], resp["content_type"])] if fragment]
+            if not candidates: return None
+            page = {"channel_name": ch_name, "html_content": ch_data["html_content"], "page_title": page_title, "active_tab_id_in_html": active_tab_id}
+            expected_profile, chosen = await run_job(match_fragment, page, self.url, [fragment[2] for _, fragment in candidates])
+            # Direct mode must reproduce every channel, otherwise the browser is needed anyway.
+            if chosen is None: return None
+            resp, (body_kind, json_path, _) = candidates[chosen]
+            recipe_channels.append({
+                "channel_name": ch_name, "active_tab_id_in_html": active_tab_id, "page_title": page_title,
+                "request": {k: resp[k] for k in ("url", "method", "headers", "post_data")},
+                "body_kind": body_kind, "json_path": json_path, "profile": expected_profile,
+            })
+        if not recipe_channels: return None
+        return {"url": self.url, "recorded_at": datetime.datetime.now().isoformat(), "channels": recipe_channels}
+
+
+class XhrRecipeStore:
+    def __init__(self, recipe_dir, safe_name_fn):
+        self.recipe_dir = recipe_dir
+        self.safe_name_fn = safe_name_fn
+        self._recipes = {}
+        self._lock = threading.Lock()
+        os.makedirs(recipe_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.recipe_dir, f"{self.safe_name_fn(url)}_xhr_recipe.json")
+
+    def get(self, url):
+        with self._lock:
+            if url in self._recipes: return self._recipes[url]
+        try:
+            with open(self._path(url), encoding="utf-8") as f: recipe = json.load(f)
+        except FileNotFoundError: recipe = None
+        except Exception as e: print(f"[XHR_WARN] Unreadable recipe for {url}: {e}"); recipe = None
+        if recipe and recipe.get("url") != url: recipe = None
+        with self._lock: self._recipes[url] = recipe
+        return recipe
+
+    def put(self, url, recipe):
+        with self._lock: self._recipes[url] = recipe
+        with open(self._path(url), "w", encoding="utf-8") as f: json.dump(recipe, f, ensure_ascii=False, indent=2)
+
+    def invalidate(self, url):
+        with self._lock: self._recipes[url] = None
+        try: os.remove(self._path(url))
+        except FileNotFoundError: pass
+
+
+_http_client = None
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=XHR_HTTP_TIMEOUT_S, follow_redirects=True, verify=False,
+                                         limits=httpx.Limits(max_connections=XHR_HTTP_MAX_CONNECTIONS, max_keepalive_connections=XHR_HTTP_MAX_CONNECTIONS))
+    return _http_client
+
+
+async def close_http_client():
+    if _http_client is not None and not _http_client.is_closed: await _http_client.aclose()
+
+
+async def replay_channel(recipe_url, channel_recipe, run_job):
+    req = channel_recipe["request"]
+    try:
+        resp = await get_http_client().request(req["method"], req["url"], headers=req["headers"], content=req.get("post_data"))
+    except httpx.HTTPError as e: raise XhrReplayError(f"{urlparse(req['url']).path}: {e}")
+    if resp.status_code >= 400: raise XhrReplayError(f"{urlparse(req['url']).path}: HTTP {resp.status_code}")
+    try:
+        if channel_recipe["body_kind"] == "json": fragment = follow_json_path(resp.json(), channel_recipe["json_path"])
+        else: fragment = resp.text
+    except (ValueError, KeyError, IndexError, TypeError) as e: raise XhrReplayError(f"Response shape changed for '{channel_recipe['channel_name']}': {e}")
+    expected_profile = channel_recipe.get("profile")
+    if not expected_profile: raise XhrReplayError(f"Recipe for '{channel_recipe['channel_name']}' predates table profiles")
+    page_html = wrap_fragment(fragment, channel_recipe["active_tab_id_in_html"])
+    profile = await run_job(table_profile, page_html, recipe_url, channel_recipe["page_title"], channel_recipe["channel_name"], list(expected_profile))
+    # Row counts may drift (a currency added or dropped); empty tables or different columns mean the endpoint changed.
+    for sel, expected in expected_profile.items():
+        got = profile.get(sel)
+        if not got or not got["rows"] or got["columns"] != expected["columns"]: raise XhrReplayError(f"Table shape changed for '{channel_recipe['channel_name']}' ({sel})")
+    return {
+        "channel_name": channel_recipe["channel_name"], "html_content": page_html,
+        "page_title": channel_recipe["page_title"], "timestamp": datetime.datetime.now().isoformat(),
+        "active_tab_id_in_html": channel_recipe["active_tab_id_in_html"], "wait_timings": [], "source": "xhr_direct",
+    }
+
+
+async def replay_recipe(recipe, run_job):
+    tasks = [asyncio.ensure_future(replay_channel(recipe["url"], ch, run_job)) for ch in recipe["channels"]]
+    try: return list(await asyncio.gather(*tasks))
+    finally:
+        # One failed channel sends the page to the browser anyway; stop the other requests and reap their errors.
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
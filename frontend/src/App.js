@@ -26,7 +26,7 @@ function App() {
     setCurrentStep(1);
 
     try {
-      const response = await axios.post('http://localhost:5000/render', { url });
+      const response = await axios.post('http://localhost:5000/render', { url, force_refresh: true });
       const responseData = response.data;
 
       if (responseData.error) {